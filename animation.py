@@ -0,0 +1,98 @@
+import numpy as np
+import pandas as pd
+import plotly.express as px
+
+FRAME_COLS = ['Date', 'state', 'tot_cases', 'Data']
+# period end used to sample each frequency, totals are cumulative so the
+# last day of a period stands for the whole period
+FREQUENCIES = {'daily': None, 'weekly': 'W', 'monthly': 'M'}
+
+
+def build_case_frames(us_cases):
+    """per day and state total cases with their hover text, one row per map point"""
+
+    us_cases = us_cases.sort_values(['Date', 'state'], kind='mergesort')
+    as_str = {col: us_cases[col].astype(str) for col in ['state', 'tot_cases', 'tot_death',
+                                                        'new_case', 'new_death']}
+    frames = pd.DataFrame({
+        'Date': us_cases['Date'].values,
+        'state': as_str['state'].values,
+        'tot_cases': us_cases['tot_cases'].fillna(0).astype('int64').values,
+    })
+    frames['Data'] = (as_str['state'] + '<br>' +
+        'Total Cases ' + as_str['tot_cases'] + '<br>' + 'Total Death ' + as_str['tot_death'] + '<br>' +
+        'New Case ' + as_str['new_case'] + '<br>' + 'New Death ' + as_str['new_death']).values
+    return frames[FRAME_COLS]
+
+
+class CaseFrames(object):
+    """Choropleth frames of total cases served one at a time
+
+    The page only ships the latest frame and a slider, every other frame is
+    a slice of the date sorted frames table looked up on demand. frames is
+    an arrow table, e.g. memory mapped from a snapshot, and only the rows of
+    a requested frame are converted to pandas.
+    """
+
+    def __init__(self, frames):
+        self.frames = frames
+        dates = frames.column('Date').to_numpy()
+        self.dates = np.unique(dates)
+        self._starts = np.searchsorted(dates, self.dates, side='left')
+        self._ends = np.searchsorted(dates, self.dates, side='right')
+        self.zmax = int(frames.column('tot_cases').to_numpy().max()) if frames.num_rows else 0
+
+    def frame_dates(self, frequency='daily'):
+        """dates of the frames of a frequency, the last day seen in each period"""
+
+        dates = pd.Series(self.dates)
+        rule = FREQUENCIES[frequency]
+        if rule is None or len(dates) == 0:
+            return list(dates)
+        periods = dates.dt.to_period(rule)
+        return list(dates.groupby(periods.values).max())
+
+    def frame(self, date):
+        i = np.searchsorted(self.dates, np.datetime64(date))
+        if i >= len(self.dates) or self.dates[i] != np.datetime64(date):
+            return self.frames.slice(0, 0).to_pandas()
+        return self.frames.slice(self._starts[i], self._ends[i] - self._starts[i]).to_pandas()
+
+    def figure(self, date):
+        """choropleth of one day, on the color range of the whole history"""
+
+        frame = self.frame(date)
+        fig = px.choropleth(frame,
+                            scope='usa',
+                            locations="state",
+                            locationmode='USA-states',
+                            color='tot_cases',
+                            hover_name="state",
+                            featureidkey='properties.state',
+                            hover_data=['Data'],
+                            range_color=(0, self.zmax),
+                            color_continuous_scale='Reds',
+                            labels={'tot_cases': 'Total Number of Cases'},
+                            title='US Covid Cases {:%Y-%m-%d}'.format(pd.Timestamp(date))
+                            )
+
+        fig.update_layout(
+            showlegend=True,
+            legend_title_text='<b>Total Number of Cases</b>',
+            font={"size": 16, "color": "#808080", "family": "calibri"},
+            margin={"r": 0, "t": 40, "l": 0, "b": 0},
+            legend=dict(orientation='v'),
+            geo=dict(bgcolor='rgba(0,0,0,0)', lakecolor='#e0fffe')
+        )
+        return fig
+
+    def slider_marks(self, dates):
+        """slider labels at the first frame of every month"""
+
+        marks = {}
+        month = None
+        for i, date in enumerate(pd.to_datetime(dates)):
+            if (date.year, date.month) != month:
+                month = (date.year, date.month)
+                marks[i] = '{:%b %y}'.format(date)
+        return marks
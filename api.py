@@ -0,0 +1,249 @@
+"""Read-only JSON/CSV api over the served snapshot
+
+    /api/v1                                 states, metrics, dimensions, date range
+    /api/v1/states/<state>                  time series of one state
+    /api/v1/metrics/<metric>                one metric of many states
+    /api/v1/surveillance/<dimension>        case surveillance breakdown
+    /api/v1/surveillance/<dimension>/monthly
+
+start, end (YYYY-MM-DD), metrics and states (comma separated) narrow a
+query, limit and offset page through it and format=csv returns csv. Every
+response carries an ETag of the snapshot version and the query, so a
+client revalidating with If-None-Match gets a 304 until the data changes.
+Rows are streamed and compressed chunk by chunk (br or gzip).
+"""
+import hashlib
+import json
+import zlib
+from urllib.parse import urlencode
+
+import brotli
+import pandas as pd
+from flask import Blueprint, Response, g, request
+
+import cube
+
+DEFAULT_LIMIT = 1000
+MAX_LIMIT = 10000
+# rows serialized at a time while streaming
+CHUNK_ROWS = 500
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super(ApiError, self).__init__(message)
+        self.status = status
+        self.message = message
+
+
+def _split(value):
+    return [v for v in value.split(',') if v] if value else None
+
+
+def _date_arg(name):
+    value = request.args.get(name)
+    # start= with nothing after it means no bound, as if it was left out
+    if not value:
+        return None
+    try:
+        date = pd.Timestamp(value)
+    except ValueError:
+        date = pd.NaT
+    if pd.isnull(date):
+        raise ApiError(400, 'Invalid {} date {}'.format(name, value))
+    return date
+
+
+def _int_arg(name, default, low, high):
+    try:
+        value = int(request.args.get(name, default))
+    except ValueError:
+        raise ApiError(400, 'Invalid {} {}'.format(name, request.args.get(name)))
+    return min(max(value, low), high)
+
+
+def _page():
+    return _int_arg('offset', 0, 0, 2 ** 31), _int_arg('limit', DEFAULT_LIMIT, 1, MAX_LIMIT)
+
+
+def _next_url(offset, limit, total):
+    if offset + limit >= total:
+        return None
+    args = request.args.to_dict()
+    args.update(offset=offset + limit, limit=limit)
+    return '{}?{}'.format(request.base_url, urlencode(args))
+
+
+def _chunks(df):
+    for start in range(0, len(df), CHUNK_ROWS):
+        chunk = df.iloc[start:start + CHUNK_ROWS].copy()
+        for col in chunk.columns:
+            if pd.api.types.is_datetime64_any_dtype(chunk[col]):
+                chunk[col] = chunk[col].dt.strftime('%Y-%m-%d')
+        yield chunk
+
+
+def _json_rows(df, header):
+    head = json.dumps(header)
+    yield head[:-1] + ', "data": ['
+    first = True
+    for chunk in _chunks(df):
+        rows = chunk.to_json(orient='records')[1:-1]
+        yield rows if first else ',' + rows
+        first = False
+    yield ']}'
+
+
+def _csv_rows(df):
+    first = True
+    for chunk in _chunks(df):
+        yield chunk.to_csv(index=False, header=first)
+        first = False
+    if first:
+        yield ','.join(df.columns) + '\n'
+
+
+def _encoding():
+    accepted = request.accept_encodings
+    for encoding in ('br', 'gzip'):
+        if accepted[encoding]:
+            return encoding
+    return None
+
+
+def _encode(chunks, encoding):
+    """compress a stream of text chunks without holding the whole body"""
+
+    if encoding == 'br':
+        compressor = brotli.Compressor()
+        for chunk in chunks:
+            yield compressor.process(chunk.encode())
+        yield compressor.finish()
+    elif encoding == 'gzip':
+        compressor = zlib.compressobj(6, zlib.DEFLATED, zlib.MAX_WBITS | 16)
+        for chunk in chunks:
+            yield compressor.compress(chunk.encode())
+        yield compressor.flush()
+    else:
+        for chunk in chunks:
+            yield chunk.encode()
+
+
+def _etag(snap):
+    return hashlib.sha1('{} {}'.format(snap.version, request.full_path).encode()).hexdigest()
+
+
+def _respond(snap, df, paged=True):
+    """stream one page of df as json or csv"""
+
+    offset, limit = _page() if paged else (0, len(df))
+    total = len(df)
+    page = df.iloc[offset:offset + limit]
+    encoding = _encoding()
+    if request.args.get('format') == 'csv':
+        body, mimetype = _csv_rows(page), 'text/csv'
+    else:
+        header = {'version': snap.version, 'total': total, 'offset': offset,
+                  'count': len(page), 'next': _next_url(offset, limit, total) if paged else None}
+        body, mimetype = _json_rows(page, header), 'application/json'
+    response = Response(_encode(body, encoding), mimetype=mimetype)
+    if encoding is not None:
+        response.headers['Content-Encoding'] = encoding
+    response.headers['X-Total-Count'] = str(total)
+    return response
+
+
+def create_api(snapshots):
+    """blueprint serving the snapshots of a SnapshotRefresher"""
+
+    api = Blueprint('api', __name__, url_prefix='/api/v1')
+
+    @api.errorhandler(ApiError)
+    def api_error(exc):
+        return {'error': exc.message}, exc.status
+
+    @api.before_request
+    def not_modified():
+        # the snapshot is immutable, the etag is known before any work
+        snap = snapshots.current()
+        if snap is None:
+            raise ApiError(503, 'No data snapshot yet')
+        g.snapshot = snap
+        if request.if_none_match.contains(_etag(snap)):
+            response = Response(status=304)
+            response.set_etag(_etag(snap))
+            return response
+
+    @api.after_request
+    def cache_headers(response):
+        if response.status_code in (200, 304):
+            response.set_etag(_etag(g.snapshot))
+            response.headers['Cache-Control'] = 'no-cache'
+            response.vary.add('Accept-Encoding')
+        return response
+
+    @api.route('')
+    def index():
+        snap = g.snapshot
+        index = snap.state_series
+        usDataDf = snap.table('usDataDf')
+        return {'version': snap.version,
+                'built_at': snap.meta['built_at'],
+                'start': '{:%Y-%m-%d}'.format(usDataDf['Date'].min()),
+                'end': '{:%Y-%m-%d}'.format(usDataDf['Date'].max()),
+                'states': index.states(),
+                'metrics': index.columns(),
+                'dimensions': cube.CASE_SURV_DIMENSIONS}
+
+    def metrics_arg(index):
+        metrics = _split(request.args.get('metrics')) or index.columns()
+        unknown = [m for m in metrics if m not in index.columns()]
+        if unknown:
+            raise ApiError(404, 'Unknown metrics {}'.format(unknown))
+        return metrics
+
+    @api.route('/states/<state>')
+    def state_series(state):
+        snap = g.snapshot
+        index = snap.state_series
+        if state not in index.states():
+            raise ApiError(404, 'Unknown state {}'.format(state))
+        df = index.frame(state, metrics_arg(index), _date_arg('start'), _date_arg('end'))
+        return _respond(snap, df)
+
+    @api.route('/metrics/<metric>')
+    def metric_series(metric):
+        snap = g.snapshot
+        index = snap.state_series
+        if metric not in index.columns():
+            raise ApiError(404, 'Unknown metric {}'.format(metric))
+        states = _split(request.args.get('states')) or index.states()
+        unknown = [s for s in states if s not in index.states()]
+        if unknown:
+            raise ApiError(404, 'Unknown states {}'.format(unknown))
+        start, end = _date_arg('start'), _date_arg('end')
+        frames = []
+        for state in states:
+            df = index.frame(state, [metric], start, end)
+            df.insert(1, 'state', state)
+            frames.append(df)
+        return _respond(snap, pd.concat(frames, ignore_index=True))
+
+    @api.route('/surveillance/<dimension>')
+    def surveillance(dimension):
+        snap = g.snapshot
+        if dimension not in cube.CASE_SURV_DIMENSIONS:
+            raise ApiError(404, 'Unknown dimension {}'.format(dimension))
+        df = snap.case_cube.breakdown(dimension, _date_arg('start'), _date_arg('end'))
+        return _respond(snap, df, paged=False)
+
+    @api.route('/surveillance/<dimension>/monthly')
+    def surveillance_monthly(dimension):
+        snap = g.snapshot
+        if dimension not in cube.CASE_SURV_DIMENSIONS:
+            raise ApiError(404, 'Unknown dimension {}'.format(dimension))
+        df = snap.case_cube.monthly(dimension).reset_index()
+        df.columns = [str(col) for col in df.columns]
+        return _respond(snap, df, paged=False)
+
+    return api
@@ -1,368 +1,415 @@
 # -*- coding: utf-8 -*-
-import datetime
-import glog
-import numpy as np
 import os
 import pandas as pd
-import processData
+import api
+import downsample
+import figcache
+import refresh
+import telemetry
 
 import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import dash_bootstrap_components as dbc
 import dash_table
-from dash.dependencies import Input, Output
+from dash.dependencies import ClientsideFunction, Input, Output, State
+from dash.exceptions import PreventUpdate
+from flask import Response
 import plotly.express as px
 
 
-prev_day = datetime.datetime.today() - datetime.timedelta(1)
-
-processData.check_download(
-    prev_day,
-    processData.usStateDataLink,
-    processData.us_state_data_query,
-    'US-State-Data',
-    'StateData')
-processData.check_download(
-    prev_day,
-    processData.caseSurveillanceData,
-    processData.case_surveillance_query,
-    'Case-Surveillance',
-    'CaseSurveillanceData')
-
-case_surv = processData.consolidate_case_surv_data()
-maxdt = case_surv['cdc_report_dt'].max()
-
-usDataDf = processData.consolidate_state_data()
-usDataDf['Date'] = usDataDf['Date'].apply(pd.to_datetime)
-usDataDf['submission_date'] = usDataDf['submission_date'].apply(pd.to_datetime)
-
-max_state_dt = usDataDf['Date'].max()
-data_str = '{}-{}-{:02d}'.format(max_state_dt.year, max_state_dt.month, max_state_dt.day)
-
-external_scripts = ['/assets/style.css']
-
-usDataDf2 = usDataDf[~usDataDf.state.isin(['US'])]
-
-# DataFrame for top new covid cases
-topCases = usDataDf2[usDataDf2['Date'] == data_str][
-    ['Date','state','tot_cases','tot_death']].sort_values('tot_cases', ascending=False)
-topCases['Date'] = topCases['Date'].apply(lambda x : x.date())
-for col in ['tot_cases','tot_death']:
-    topCases[col]=topCases[col].apply(lambda x: f'{x:,}')
-
-USTotalCases = usDataDf2[usDataDf2['submission_date']==data_str]['tot_cases'].astype(float).sum()
-statesNames = usDataDf.sort_values('state')['state'].unique().tolist()
-usDataDf['new_case'] = usDataDf['new_case'].astype(float)
-
-USTopNewCases = usDataDf2[usDataDf2['submission_date'] == data_str][['state', 'new_case',
-'7 day average new cases','new_death']].sort_values(
-    by='new_case', ascending=False)
-
-us_bar = px.bar(USTopNewCases.sort_values(by='new_case',ascending=True), 
-    y = 'state', x = 'new_case', text='new_case', orientation='h', color='new_case',
-     color_continuous_scale=["orange", "red"], height=1000)
-us_bar.update_traces(texttemplate='%{text:.2s}', textposition='outside')
-us_bar.update_layout(uniformtext_minsize=6, uniformtext_mode='hide', 
-                     xaxis={'categoryorder':'total descending'})
-
-for col in ['new_case', '7 day average new cases']:
-    USTopNewCases[col]=USTopNewCases[col].apply(lambda x: f'{x:,}')
-
-# data for death rate 
-death_rate_rank = usDataDf[usDataDf['Date'] == data_str].sort_values(
-    'death rate', ascending=False, na_position='last')[['state', 'death rate']]
-death_rate_rank['death rate'] = death_rate_rank['death rate'].apply(lambda x: '{:.2f}%'.format(x))
-
-# data for total cases animation
-us_cases = usDataDf2.copy()
-for col in us_cases.columns:
-    us_cases[col] = us_cases[col].astype(str)
-
-us_cases = us_cases[['Date', 'submission_date', 'state',
-                     'tot_cases', 'tot_death', 'new_case', 'new_death']]
-
-us_cases['Data'] =us_cases['state'] + '<br>' + \
-    'Total Cases ' + us_cases['tot_cases'] + '<br>' + 'Total Death ' + us_cases['tot_death'] + '<br>' + \
-    'New Case ' + us_cases['new_case'] +'<br>' + 'New Death ' + us_cases['new_death']
-
-glog.info('Plot animation')
-
-us_cases['tot_cases'] = us_cases['tot_cases'].astype(float).astype(int)
-
-fig = px.choropleth(us_cases,
-                    scope='usa',
-                    locations="state",
-                    locationmode='USA-states',
-                    color=us_cases['tot_cases'],
-                    hover_name="state",
-                    featureidkey='properties.state',
-                    hover_data=['Data'],
-                    animation_frame="Date", animation_group="state",
-                    color_continuous_scale='Reds',
-                    labels={'tot_cases': 'Total Number of Cases'},
-                    title='US Covid Cases'
-                    )
-
-fig.update_layout(
-    showlegend=True,
-    legend_title_text='<b>Total Number of Cases</b>',
-    font={"size": 16, "color": "#808080", "family": "calibri"},
-    margin={"r": 0, "t": 40, "l": 0, "b": 0},
-    legend=dict(orientation='v'),
-    geo=dict(bgcolor='rgba(0,0,0,0)', lakecolor='#e0fffe')
-)
-
-#Data for adjusted case rate
-data = usDataDf2[usDataDf2['Date'] == data_str]
-
-app = dash.Dash(__name__, external_stylesheets=[dbc.themes.LUMEN])
-# app = dash.Dash(__name__, external_stylesheets=external_scripts)
+# figures are cached per data version, a new snapshot invalidates them
+figure_cache = figcache.FigureCache(
+    max_bytes=int(os.environ.get('FIGURE_CACHE_MB', 64)) * 1024 ** 2,
+    cache_dir=os.environ.get('FIGURE_CACHE_DIR'))
+
+# the data pipeline runs in snapshot.py, a worker only opens its output and
+# swaps in every new snapshot made current by a scheduled rebuild. Without
+# any snapshot yet the server answers with a placeholder page while the
+# first one is built in the background.
+snapshots = refresh.SnapshotRefresher(listeners=[lambda snap: figure_cache.set_version(snap.version)])
+snapshots.load(preload=bool(os.environ.get('PRELOAD_SNAPSHOT')))
+
+# compress=True serves the dash responses through Flask-Compress (br or gzip)
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.LUMEN], compress=True)
 server = app.server
+server.register_blueprint(api.create_api(snapshots))
+# PROFILE_DIR writes a cProfile of PROFILE_SAMPLE (a fraction) of the requests
+telemetry.instrument_server(server, profile_dir=os.environ.get('PROFILE_DIR'),
+                            profile_sample=float(os.environ.get('PROFILE_SAMPLE', 1)))
+
+
+@ server.before_request
+def start_refresh():
+    snapshots.ensure_started()
+
+
+@ server.route('/data-version')
+def data_version():
+    snap = snapshots.current()
+    if snap is None:
+        return {'error': 'No data snapshot yet'}, 503
+    return {'version': snap.version, 'built_at': snap.meta['built_at']}
+
+
+def serving_metrics():
+    """figure cache, served snapshot and the pipeline run that built it, read at every scrape"""
+
+    cache = telemetry.Gauge('covid_figure_cache', 'Figure cache counters of this worker.')
+    stats = figure_cache.stats()
+    for key in ('hits', 'misses', 'hit_rate', 'entries', 'bytes'):
+        cache.set(stats[key], stat=key)
+    snap = snapshots.current()
+    if snap is None:
+        return [cache]
+
+    info = telemetry.Gauge('covid_data_info', 'Snapshot served by this worker.')
+    info.set(1, version=snap.version, built_at=snap.meta['built_at'], data_date=snap.meta['data_str'])
+    rows = telemetry.Gauge('covid_snapshot_rows', 'Rows of a table of the served snapshot.')
+    for name in snap.meta['tables']:
+        rows.set(snap.arrow(name).num_rows, table=name)
+
+    pipeline = [telemetry.Gauge('covid_snapshot_stage_{}'.format(key),
+                                'Pipeline run that built the served snapshot, {} of a stage.'.format(key))
+                for key in ('seconds', 'calls', 'rows', 'rss_bytes', 'rss_growth_bytes')]
+    for stage in snap.meta.get('pipeline', []):
+        for gauge in pipeline:
+            gauge.set(stage[gauge.name[len('covid_snapshot_stage_'):]], stage=stage['stage'], **stage['labels'])
+    return [cache, info, rows] + pipeline
+
+telemetry.REGISTRY.add_collector(serving_metrics)
+
+
+@ server.route('/metrics')
+def prometheus_metrics():
+    # every gunicorn worker answers with its own requests and cache
+    return Response(telemetry.render(), mimetype='text/plain; version=0.0.4')
+
+# frames of the cases animation: default sampling and time between frames when playing
+ANIMATION_FREQUENCY = 'weekly'
+ANIMATION_INTERVAL_MS = 500
+DEATH_COLS = ['death rate', 'case fatality rate']
 
 title_shared_style = {'textAlign': 'left', 'marginLeft': 50, 'marginBottom': 30, 'marginTop': 30}
 
-app.layout = html.Div([
-    html.H1("US Covid Data Dashboard", style={"textAlign": "center"}), 
-    dcc.Markdown('''US covid data visualization using CDC public data''', style={"textAlign": "center"}),
-    dcc.Tabs(
-        id="tabs", 
-        children=[
-        dcc.Tab(
-            label='Daily Summary',
-            className ='custom-tab',
-            selected_className ='custom-tab--selected',
+
+def serve_layout():
+    """page layout filled from the current snapshot"""
+
+    snap = snapshots.current()
+    if snap is None:
+        return html.Div([
+            html.H1("US Covid Data Dashboard", style={"textAlign": "center"}),
+            dcc.Markdown('The data is being prepared, reload the page in a few minutes.',
+                         style={"textAlign": "center"})])
+    data_str = snap.meta['data_str']
+    maxdt = snap.meta['maxdt']
+    USTotalCases = snap.meta['USTotalCases']
+    statesNames = snap.meta['statesNames']
+    USTopNewCases = snap.table('USTopNewCases')
+    topCases = snap.table('topCases')
+    death_rate_rank = snap.table('death_rate_rank')
+    us_bar = snap.figure('us_bar')
+    frame_dates = snap.case_frames.frame_dates(ANIMATION_FREQUENCY)
+
+    return html.Div([
+        html.H1("US Covid Data Dashboard", style={"textAlign": "center"}), 
+        dcc.Markdown('''US covid data visualization using CDC public data''', style={"textAlign": "center"}),
+        dcc.Tabs(
+            id="tabs", 
             children=[
-                html.Div([
-                    dcc.Markdown('''### As of ***{}*** US Total Reported Cases: ***{}***'''.format(data_str, 
-                    f'{int(USTotalCases):,}'),
-                        style={'fontSize':'40','textAlign': 'left', 'fontColor':'black',
-                        'marginLeft': 50, 'marginBottom': 30, 
-                        'marginTop': 30}),
-                    html.H3(
-                        "Top 5 States with the Most New Cases Today",
-                        style=title_shared_style),
-                    dash_table.DataTable(
-                        id='table2',
-                        columns=[ {'name': i, 'id': i} for i in USTopNewCases.columns],
-                        data=USTopNewCases.iloc[0:5, :].to_dict('rows')),
-                    html.H3("US New Cases by States", style={"textAlign": "left", 
-                    'marginLeft': 50, 'marginBottom': 30, 'marginTop': 30}),
-                    dcc.Graph(figure=us_bar),
-                    html.H3("US New Cases by States Time Series", style=title_shared_style),
+            dcc.Tab(
+                label='Daily Summary',
+                className ='custom-tab',
+                selected_className ='custom-tab--selected',
+                children=[
                     html.Div([
+                        dcc.Markdown('''### As of ***{}*** US Total Reported Cases: ***{}***'''.format(data_str, 
+                        f'{int(USTotalCases):,}'),
+                            style={'fontSize':'40','textAlign': 'left', 'fontColor':'black',
+                            'marginLeft': 50, 'marginBottom': 30, 
+                            'marginTop': 30}),
+                        html.H3(
+                            "Top 5 States with the Most New Cases Today",
+                            style=title_shared_style),
+                        dash_table.DataTable(
+                            id='table2',
+                            columns=[ {'name': i, 'id': i} for i in USTopNewCases.columns],
+                            data=USTopNewCases.iloc[0:5, :].to_dict('rows')),
+                        html.H3("US New Cases by States", style={"textAlign": "left", 
+                        'marginLeft': 50, 'marginBottom': 30, 'marginTop': 30}),
+                        dcc.Graph(figure=us_bar),
+                        html.H3("US New Cases by States Time Series", style=title_shared_style),
                         html.Div([
-                            dcc.Dropdown(
-                                id='state-selected2',
-                                value='US',
-                                options=[{'label': i, 'value': i} for i in statesNames]),
-                                dcc.RadioItems(
-                                id='selected-col',
-                                options=[{'label': i, 'value': i} for i in ['new_case', 
-                                '7 day average new cases',
-                                'New Cases per Population',
-                                'Adjusted Case Rate']],
-                                value='new_case',
-                                labelStyle={'display': 'inline-block'}
-                                )
-                                ],
-                                style={"display": "block",
-                                        "marginLeft": "auto",
-                                        "marginRight": "auto",
-                                        "width": "80%"}),
-                            ]),
-                    dcc.Graph(id='us_new_cases'),
-                    html.H3(
-                        "COVID Risk Level",
-                        style=title_shared_style),
-                    dcc.Markdown('''
-                         If we use CA risk level definition(using only Adjusted case rate definition), 
-                         we can see how widespread the COVID case growth has been at states level. 
-
-                        Adjusted Case Rate: Calculated as the average daily number of COVID-19+ cases over 7 days 
-                        divided by the number of people living in the state then multiplied by 100,000.
-
-                        CA Blueprint for a Safer Economy [links]:(https://covid19.ca.gov/safer-economy/)
-                        ''',style=title_shared_style), 
+                            html.Div([
+                                dcc.Dropdown(
+                                    id='state-selected2',
+                                    value='US',
+                                    options=[{'label': i, 'value': i} for i in statesNames]),
+                                    dcc.RadioItems(
+                                    id='selected-col',
+                                    options=[{'label': i, 'value': i} for i in ['new_case', 
+                                    '7 day average new cases',
+                                    'New Cases per Population',
+                                    'Adjusted Case Rate']],
+                                    value='new_case',
+                                    labelStyle={'display': 'inline-block'}
+                                    )
+                                    ],
+                                    style={"display": "block",
+                                            "marginLeft": "auto",
+                                            "marginRight": "auto",
+                                            "width": "80%"}),
+                                ]),
+                        dcc.Graph(id='us_new_cases'),
+                        html.H3(
+                            "COVID Risk Level",
+                            style=title_shared_style),
+                        dcc.Markdown('''
+                             If we use CA risk level definition(using only Adjusted case rate definition), 
+                             we can see how widespread the COVID case growth has been at states level. 
+
+                            Adjusted Case Rate: Calculated as the average daily number of COVID-19+ cases over 7 days 
+                            divided by the number of people living in the state then multiplied by 100,000.
+
+                            CA Blueprint for a Safer Economy [links]:(https://covid19.ca.gov/safer-economy/)
+                            ''',style=title_shared_style), 
+                        html.Div([
+                            html.Div([dcc.RadioItems(
+                                    id='selected-risk-col',
+                                    options=[{'label': i, 'value': i} for i in 
+                                    ['Adjusted Case Rate','CA Risk Level Threshold']],
+                                    value='Adjusted Case Rate',
+                                    labelStyle={'display': 'inline-block'}
+                                    )],
+                                    style={"display": "block",
+                                            "marginLeft": "auto",
+                                            "marginRight": "auto",
+                                            "width": "80%"}),
+                                ]),
+                        dcc.Store(id='risk-figures', data=snap.figure('risk_maps')),
+                        dcc.Graph(id='us_risk_level')
+                    ])]),
+            # First Tab
+            dcc.Tab(
+                label='US Total Cases',
+                className ='custom-tab',
+                selected_className ='custom-tab--selected',
+                children=[
                     html.Div([
-                        html.Div([dcc.RadioItems(
-                                id='selected-risk-col',
-                                options=[{'label': i, 'value': i} for i in 
-                                ['Adjusted Case Rate','CA Risk Level Threshold']],
-                                value='Adjusted Case Rate',
-                                labelStyle={'display': 'inline-block'}
-                                )],
-                                style={"display": "block",
-                                        "marginLeft": "auto",
-                                        "marginRight": "auto",
-                                        "width": "80%"}),
-                            ]),
-                    dcc.Graph(id='us_risk_level')
-                ])]),
-        # First Tab
-        dcc.Tab(
-            label='US Total Cases',
-            className ='custom-tab',
-            selected_className ='custom-tab--selected',
-            children=[
-                html.Div([
-                    html.H3(
-                        "Top 5 States by Total Covid Cases", 
-                        style=title_shared_style),
-                    dash_table.DataTable(
-                        id='table',
-                        columns=[{"name": i, "id": i} for i in topCases.columns],
-                        data=topCases.iloc[0:5, :].to_dict("rows")),
-                    html.H3(
-                        "Covid Cases by States Animation", 
-                        style=title_shared_style),
-                    dcc.Graph(figure=fig)
-                    ])]
-        ),
-        # Second Tab
-        dcc.Tab(
-            label='US Death Rate',
-            className ='custom-tab',
-            selected_className ='custom-tab--selected',
-            children=[
-                html.Div([
-                    html.H3(
-                        "Top 5 States with the Highest Death Rate",
-                        style=title_shared_style),
-                    dash_table.DataTable(
-                        id='table4',
-                        columns=[ {"name": i, "id": i} for i in death_rate_rank.columns],
-                        data=death_rate_rank.iloc[0:5, :].to_dict('rows'),
-                        style_header={'backgroundColor': 'rgb(230, 230, 230)', 'fontWeight': 'bold'},
-                        style_cell={
-                            'textAlign': 'center',
-                            'font-family' : 'var(--text_font_family)'
-                        },
-                        style_data={"margin-left": "auto", "margin-right": "auto"}),
-
-                    html.H3("US Death Rate(%) by States", style=title_shared_style),
+                        html.H3(
+                            "Top 5 States by Total Covid Cases", 
+                            style=title_shared_style),
+                        dash_table.DataTable(
+                            id='table',
+                            columns=[{"name": i, "id": i} for i in topCases.columns],
+                            data=topCases.iloc[0:5, :].to_dict("rows")),
+                        html.H3(
+                            "Covid Cases by States Animation", 
+                            style=title_shared_style),
+                        # only the last frame is drawn on load, the slider fetches the others
+                        html.Div([
+                            dcc.RadioItems(
+                                id='cases-frequency',
+                                value=ANIMATION_FREQUENCY,
+                                options=[{'label': i, 'value': i} for i in ['daily', 'weekly', 'monthly']],
+                                labelStyle={'display': 'inline-block'}),
+                            html.Button('Play', id='cases-play', n_clicks=0),
+                            dcc.Slider(
+                                id='cases-frame',
+                                min=0,
+                                max=len(frame_dates) - 1,
+                                step=1,
+                                value=len(frame_dates) - 1,
+                                marks=snap.case_frames.slider_marks(frame_dates)),
+                            dcc.Interval(id='cases-interval', interval=ANIMATION_INTERVAL_MS, disabled=True)
+                            ],
+                            style={"display": "block",
+                                    "marginLeft": "auto",
+                                    "marginRight": "auto",
+                                    "width": "80%"}),
+                        dcc.Graph(id='us_cases_map')
+                        ])]
+            ),
+            # Second Tab
+            dcc.Tab(
+                label='US Death Rate',
+                className ='custom-tab',
+                selected_className ='custom-tab--selected',
+                children=[
                     html.Div([
+                        html.H3(
+                            "Top 5 States with the Highest Death Rate",
+                            style=title_shared_style),
+                        dash_table.DataTable(
+                            id='table4',
+                            columns=[ {"name": i, "id": i} for i in death_rate_rank.columns],
+                            data=death_rate_rank.iloc[0:5, :].to_dict('rows'),
+                            style_header={'backgroundColor': 'rgb(230, 230, 230)', 'fontWeight': 'bold'},
+                            style_cell={
+                                'textAlign': 'center',
+                                'font-family' : 'var(--text_font_family)'
+                            },
+                            style_data={"margin-left": "auto", "margin-right": "auto"}),
+
+                        html.H3("US Death Rate(%) by States", style=title_shared_style),
+                        html.Div([
                         
-                            dcc.Markdown('''
-                            Death Rate(%) is number of death divided by the population.
-                            Case Fatality Rate is the number of death divided by the number of confirmed cases.
-                            ''',style=title_shared_style),
-                            dcc.Dropdown(
-                                id='state-selected',
-                                value='US',
-                                options=[{'label': i, 'value': i} for i in statesNames],
+                                dcc.Markdown('''
+                                Death Rate(%) is number of death divided by the population.
+                                Case Fatality Rate is the number of death divided by the number of confirmed cases.
+                                ''',style=title_shared_style),
+                                dcc.Dropdown(
+                                    id='state-selected',
+                                    value='US',
+                                    options=[{'label': i, 'value': i} for i in statesNames],
+                                    style=title_shared_style),
+                                dcc.RadioItems(
+                                    id='death-col',
+                                    value='death rate',
+                                    options=[{'label': i, 'value': i} for i in DEATH_COLS],
+                                    labelStyle={'display': 'inline-block'},
+                                    style=title_shared_style),
+                                ]),
+                            dcc.Store(id='death-figures'),
+                            dcc.Graph(id='us_death_rate')])
+                        ]),
+            # Third Tab
+            dcc.Tab(
+                label='US Case Surveillance',
+                className ='custom-tab',
+                selected_className ='custom-tab--selected',
+                children=[
+                    html.Div([
+                            html.H3('US Covid Case Surveillance Data',
+                                    style=title_shared_style),
+                            dcc.Markdown(
+                                ''' CDC updates this data on montly basis, latest update: {}'''.format(maxdt[:10]),
                                 style=title_shared_style),
                             dcc.RadioItems(
-                                id='death-col',
-                                value='death rate',
-                                options=[{'label': i, 'value': i} for i in ['death rate', 'case fatality rate']],
-                                labelStyle={'display': 'inline-block'},
+                                id='case-selected',
+                                value='sex',
+                                options=[{'label': i, 'value': i} for i in ['hosp_yn', 'current_status', 'sex',
+                                                                            'age_group', 'race_ethnicity_combined', 
+                                                                            'icu_yn', 'death_yn','medcond_yn']],
                                 style=title_shared_style),
-                            ]),
-                        dcc.Graph(id='us_death_rate')])
-                    ]),
-        # Third Tab
-        dcc.Tab(
-            label='US Case Surveillance',
-            className ='custom-tab',
-            selected_className ='custom-tab--selected',
-            children=[
-                html.Div([
-                        html.H3('US Covid Case Surveillance Data',
-                                style=title_shared_style),
-                        dcc.Markdown(
-                            ''' CDC updates this data on montly basis, latest update: {}'''.format(maxdt[:10]),
-                            style=title_shared_style),
-                        dcc.RadioItems(
-                            id='case-selected',
-                            value='sex',
-                            options=[{'label': i, 'value': i} for i in ['hosp_yn', 'current_status', 'sex',
-                                                                        'age_group', 'race_ethnicity_combined', 
-                                                                        'icu_yn', 'death_yn','medcond_yn']],
-                            style=title_shared_style),
-                        dcc.Graph(id='us_case_surv')])
-                    ]
-            )
-        ])
-])
+                            dcc.Store(id='case-surv-figures', data=snap.figure('case_surv_charts')),
+                            dcc.Graph(id='us_case_surv')])
+                        ]
+                )
+            ])
+    ])
 
 
-@ app.callback(Output('us_death_rate', 'figure'),
-               [Input('state-selected', 'value'),
-                Input('death-col', 'value')
-               ])
-def update_graph(selected_dropdown, death_col):
 
+app.layout = serve_layout
 
-    chart_title = 'State Death Rate Time Series: {}'.format(selected_dropdown)
-    figure = px.line(usDataDf[usDataDf['state'] == selected_dropdown].sort_values(by='Date'),
-                     x="Date",
-                     y=death_col,
-                     title=chart_title)
+def line_figure(state, col, chart_title, relayout_data):
+    """line chart of one state series, downsampled unless zoomed into a range"""
 
+    index = snapshots.current().state_series
+    zoom = downsample.x_range(relayout_data)
+    if zoom is None:
+        frame = downsample.downsample(index.frame(state, [col]), 'Date', col)
+    else:
+        # a zoomed range gets every point in it
+        frame = index.frame(state, [col], pd.Timestamp(zoom[0]), pd.Timestamp(zoom[1]))
+    figure = px.line(frame, x="Date", y=col, title=chart_title)
+    if zoom is not None:
+        figure.update_xaxes(range=list(zoom))
     return figure
 
-@ app.callback(Output('us_new_cases', 'figure'),
-               [Input('state-selected2', 'value'),
-                Input('selected-col', 'value')])
+def skip_relayout(graph_id, relayout_data):
+    """stop a callback triggered by a relayout that leaves the x axis alone"""
 
-def update_newcases_graph(selected_dropdown, selected_col):
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if triggered == ['{}.relayoutData'.format(graph_id)] and not downsample.changes_x(relayout_data):
+        raise PreventUpdate
 
-    chart_title = 'State New Cases Time Series: {}'.format(selected_dropdown)
-    figure = px.line(usDataDf[usDataDf['state'] == selected_dropdown].sort_values(by='Date'),
-                     x="Date",
-                     y=selected_col,
-                     title=chart_title)
+# the death chart toggle is switched on the page, the server sends both figures per state
+@ app.callback(Output('death-figures', 'data'),
+               [Input('state-selected', 'value'),
+                Input('us_death_rate', 'relayoutData')])
+@ telemetry.timed_callback('update_death_figures')
+@ figure_cache.cached('update_death_figures')
+def update_death_figures(selected_dropdown, relayout_data):
 
-    return figure
+    skip_relayout('us_death_rate', relayout_data)
+    chart_title = 'State Death Rate Time Series: {}'.format(selected_dropdown)
+    return {death_col: line_figure(selected_dropdown, death_col, chart_title, relayout_data)
+            for death_col in DEATH_COLS}
 
-@ app.callback(Output('us_risk_level', 'figure'),
-               [Input('selected-risk-col', 'value')])
+app.clientside_callback(
+    ClientsideFunction(namespace='figures', function_name='pick'),
+    Output('us_death_rate', 'figure'),
+    [Input('death-col', 'value'), Input('death-figures', 'data')])
 
-def update_usrisk_chart(selected_risk_col):
+@ app.callback(Output('us_new_cases', 'figure'),
+               [Input('state-selected2', 'value'),
+                Input('selected-col', 'value'),
+                Input('us_new_cases', 'relayoutData')])
+@ telemetry.timed_callback('update_newcases_graph')
+@ figure_cache.cached('update_newcases_graph')
+def update_newcases_graph(selected_dropdown, selected_col, relayout_data):
 
-    if selected_risk_col =='CA Risk Level Threshold':
-        col = 'Risk Level'
+    skip_relayout('us_new_cases', relayout_data)
+    chart_title = 'State New Cases Time Series: {}'.format(selected_dropdown)
+    return line_figure(selected_dropdown, selected_col, chart_title, relayout_data)
+
+@ app.callback([Output('cases-frame', 'max'),
+                Output('cases-frame', 'marks'),
+                Output('cases-frame', 'value'),
+                Output('cases-interval', 'disabled'),
+                Output('cases-play', 'children')],
+               [Input('cases-frequency', 'value'),
+                Input('cases-interval', 'n_intervals'),
+                Input('cases-play', 'n_clicks')],
+               [State('cases-frame', 'value'),
+                State('cases-interval', 'disabled')])
+@ telemetry.timed_callback('update_cases_slider')
+def update_cases_slider(frequency, n_intervals, n_clicks, frame, stopped):
+
+    case_frames = snapshots.current().case_frames
+    frame_dates = case_frames.frame_dates(frequency)
+    last = len(frame_dates) - 1
+    triggered = [t['prop_id'] for t in dash.callback_context.triggered]
+    if 'cases-play.n_clicks' in triggered:
+        # play from the start when the slider sits on the last frame
+        stopped = not stopped
+        if not stopped and frame >= last:
+            frame = 0
+    elif 'cases-interval.n_intervals' in triggered:
+        frame = min(frame + 1, last)
+        stopped = frame >= last
     else:
-        col = 'Adjusted Case Rate'
-
-    figure = px.choropleth(data,
-                        scope='usa',
-                        locations="state",
-                        locationmode='USA-states',
-                        color=data[col],
-                        hover_name="state",
-                        featureidkey='properties.state',
-                        hover_data=['Adjusted Case Rate'],
-                        color_continuous_scale='Reds',
-                        labels={
-                            'Risk Level': 'Risk level based on Adjusted Case Rate'},
-                        title='State Risk Level'
-                        )
-
-    figure.update_layout(
-        showlegend=True,
-        legend_title_text='<b>Risk Level</b>',
-        font={"size": 16, "color": "#808080", "family": "calibri"},
-        margin={"r": 0, "t": 40, "l": 0, "b": 0},
-        legend=dict(orientation='v'),
-        geo=dict(bgcolor='rgba(0,0,0,0)', lakecolor='#e0fffe')
-    )
-
-    return figure
-
-@ app.callback(Output('us_case_surv', 'figure'),
-               [Input('case-selected', 'value')])
-
-def update_casesurv_chart(case_selected):
-
-    
-    datadf=case_surv.groupby(case_selected).count()/case_surv.shape[0]
-    datadf=datadf.reset_index()
-    datadf['% Count'] = datadf['cdc_report_dt'].apply(lambda x: '{}%'.format(round(100.0*x,2)))
-    figure = px.bar(datadf, x=case_selected, y='% Count', color=case_selected)
-
-    return figure
+        frame = last
+    marks = case_frames.slider_marks(frame_dates)
+    return last, marks, frame, stopped, 'Play' if stopped else 'Pause'
+
+@ app.callback(Output('us_cases_map', 'figure'),
+               [Input('cases-frame', 'value'),
+                Input('cases-frequency', 'value')])
+@ telemetry.timed_callback('update_cases_map')
+@ figure_cache.cached('update_cases_map')
+def update_cases_map(frame, frequency):
+
+    case_frames = snapshots.current().case_frames
+    frame_dates = case_frames.frame_dates(frequency)
+    date = frame_dates[max(0, min(frame, len(frame_dates) - 1))]
+    return case_frames.figure(date)
+
+app.clientside_callback(
+    ClientsideFunction(namespace='figures', function_name='pick'),
+    Output('us_risk_level', 'figure'),
+    [Input('selected-risk-col', 'value'), Input('risk-figures', 'data')])
+
+app.clientside_callback(
+    ClientsideFunction(namespace='figures', function_name='pick'),
+    Output('us_case_surv', 'figure'),
+    [Input('case-selected', 'value'), Input('case-surv-figures', 'data')])
+
+# after the last @app.callback, adds the time dash takes to serialize every response
+telemetry.instrument_dash(app)
 
 if __name__ == '__main__':
     app.run_server(debug=True)
@@ -0,0 +1,12 @@
+// figures of a view toggle are sent to the page once, switching between them
+// happens here without a request to the server
+window.dash_clientside = Object.assign({}, window.dash_clientside, {
+    figures: {
+        pick: function(view, figures) {
+            if (!figures || !(view in figures)) {
+                return window.dash_clientside.no_update;
+            }
+            return figures[view];
+        }
+    }
+});
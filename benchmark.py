@@ -0,0 +1,264 @@
+"""Benchmark the data pipeline and the dashboard on synthetic data
+
+    python benchmark.py --days 365 --surv-rows 1000000 --output bench.json
+
+Synthetic daily files (see synthetic.py) are served by a local fake
+Socrata server and the whole pipeline runs against it in a scratch
+directory: check_download of both datasets, consolidate_state_data (first
+build, then a run with nothing new), consolidate_case_surv_data, the
+snapshot build, a cold start of app.py and the latency of every server
+side callback. The results are written as json, run it on two commits
+with the same arguments to compare them.
+"""
+import argparse
+import datetime
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import glog
+import numpy as np
+import pandas as pd
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+# inputs of the pipeline that are not downloaded
+STATIC_FILES = ['StateCode.csv', os.path.join('data', 'pop.html')]
+
+# python run in a subprocess to time a cold start of the dashboard
+STARTUP_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+client = app.server.test_client()
+client.get('/_dash-layout')
+print(json.dumps({'import_seconds': imported - start,
+                  'first_layout_seconds': time.perf_counter() - imported}))
+"""
+
+
+class Timings(object):
+    """wall time and result of named steps"""
+
+    def __init__(self):
+        self.stages = {}
+
+    def run(self, name, func, *args, **kwargs):
+        glog.info('Benchmarking {}'.format(name))
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        self.stages[name] = {'seconds': time.perf_counter() - start}
+        glog.info('{} took {:.3f}s'.format(name, self.stages[name]['seconds']))
+        return result
+
+
+def _git_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _versions():
+    import dash
+    import plotly
+    import pyarrow
+    return {'python': platform.python_version(), 'pandas': pd.__version__, 'numpy': np.__version__,
+            'pyarrow': pyarrow.__version__, 'dash': dash.__version__, 'plotly': plotly.__version__}
+
+
+def _latency(seconds):
+    seconds = np.asarray(seconds)
+    return {'runs': len(seconds), 'mean': float(seconds.mean()), 'p50': float(np.percentile(seconds, 50)),
+            'p95': float(np.percentile(seconds, 95)), 'max': float(seconds.max())}
+
+
+def _update_body(outputs, inputs, state=(), changed=()):
+    """body of a /_dash-update-component request, outputs and inputs as (id, property[, value])"""
+
+    if len(outputs) == 1:
+        output = '{}.{}'.format(*outputs[0])
+        response_outputs = {'id': outputs[0][0], 'property': outputs[0][1]}
+    else:
+        output = '..{}..'.format('...'.join('{}.{}'.format(*o) for o in outputs))
+        response_outputs = [{'id': i, 'property': p} for i, p in outputs]
+    return {'output': output, 'outputs': response_outputs,
+            'inputs': [{'id': i, 'property': p, 'value': v} for i, p, v in inputs],
+            'state': [{'id': i, 'property': p, 'value': v} for i, p, v in state],
+            'changedPropIds': list(changed)}
+
+
+def callback_requests(snap):
+    """(name, request body) of every server side callback, over several states and frames"""
+
+    states = [s for s in snap.state_series.states() if s != 'US'][:4] + ['US']
+    frames = list(range(0, len(snap.case_frames.frame_dates('daily')), 30))[:4] or [0]
+    slider_outputs = [('cases-frame', 'max'), ('cases-frame', 'marks'), ('cases-frame', 'value'),
+                      ('cases-interval', 'disabled'), ('cases-play', 'children')]
+    requests = []
+    for state in states:
+        requests.append(('update_death_figures', _update_body(
+            [('death-figures', 'data')],
+            [('state-selected', 'value', state), ('us_death_rate', 'relayoutData', None)],
+            changed=['state-selected.value'])))
+        requests.append(('update_newcases_graph', _update_body(
+            [('us_new_cases', 'figure')],
+            [('state-selected2', 'value', state), ('selected-col', 'value', 'new_case'),
+             ('us_new_cases', 'relayoutData', None)],
+            changed=['state-selected2.value'])))
+    for frequency in ('daily', 'weekly', 'monthly'):
+        requests.append(('update_cases_slider', _update_body(
+            slider_outputs,
+            [('cases-frequency', 'value', frequency), ('cases-interval', 'n_intervals', 1),
+             ('cases-play', 'n_clicks', None)],
+            [('cases-frame', 'value', 0), ('cases-interval', 'disabled', False)],
+            changed=['cases-interval.n_intervals'])))
+        for frame in frames:
+            requests.append(('update_cases_map', _update_body(
+                [('us_cases_map', 'figure')],
+                [('cases-frame', 'value', frame), ('cases-frequency', 'value', frequency)],
+                changed=['cases-frame.value'])))
+    return requests
+
+
+def api_requests(snap):
+    state = snap.state_series.states()[0]
+    return [('api_state', '/api/v1/states/{}'.format(state)),
+            ('api_metric', '/api/v1/metrics/new_case'),
+            ('api_surveillance', '/api/v1/surveillance/age_group'),
+            ('api_surveillance_monthly', '/api/v1/surveillance/age_group/monthly')]
+
+
+def time_requests(client, requests, send, repeat):
+    """latency of each named request, every request sent repeat times"""
+
+    seconds = {}
+    for name, request in requests:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            response = send(client, request)
+            if response.status_code not in (200, 204):
+                raise RuntimeError('{} returned {}'.format(name, response.status_code))
+            seconds.setdefault(name, []).append(time.perf_counter() - start)
+    return {name: _latency(values) for name, values in seconds.items()}
+
+
+def run(workdir, days, surv_rows, seed, repeat, serve_api):
+    # read when snapshot.py and app.py are imported, the figure cache is off
+    # so the callbacks do their real work every time
+    snapshot_root = os.path.join(workdir, 'snapshot')
+    os.environ.update(SNAPSHOT_DIR=snapshot_root, FIGURE_CACHE_MB='0')
+    os.environ.pop('FIGURE_CACHE_DIR', None)
+    import downloader
+    import processData
+    import snapshot
+    import synthetic
+    import telemetry
+
+    timings = Timings()
+    for name in STATIC_FILES:
+        target = os.path.join(workdir, name)
+        if not os.path.exists(os.path.dirname(target)):
+            os.makedirs(os.path.dirname(target))
+        shutil.copy(os.path.join(REPO_DIR, name), target)
+    # the pipeline reads and writes relative to the working directory
+    os.chdir(workdir)
+
+    states = [s for s in processData.load_population()['State or Region Code'] if s != 'US']
+    remote = os.path.join(workdir, 'remote')
+    state_rows = timings.run('generate_state_data', synthetic.write_state_data,
+                             os.path.join(remote, 'state'), states, days, seed=seed)
+    case_surv_rows = timings.run('generate_case_surv_data', synthetic.write_case_surv_data,
+                                 os.path.join(remote, 'case_surv'), surv_rows, days, seed=seed)
+
+    last_day = synthetic.date_range(days)[-1]
+    datasets = {processData.usStateDataLink: (os.path.join(remote, 'state'), 'US-State-Data'),
+                processData.caseSurveillanceData: (os.path.join(remote, 'case_surv'), 'Case-Surveillance')}
+    with synthetic.FakeSocrata(datasets) as fake:
+        factory = downloader.socrata_client_factory(fake.domain, 'http://', pool_size=downloader.MAX_WORKERS)
+        with downloader.Downloader(client_factory=factory) as client:
+            timings.run('check_download_state', processData.check_download, last_day,
+                        processData.usStateDataLink, processData.us_state_data_query,
+                        'US-State-Data', 'StateData', client=client)
+            timings.run('check_download_case_surv', processData.check_download, last_day,
+                        processData.caseSurveillanceData, processData.case_surveillance_query,
+                        'Case-Surveillance', 'CaseSurveillanceData', client=client)
+        socrata_requests = fake.requests
+
+    timings.run('consolidate_state_data', processData.consolidate_state_data)
+    timings.run('consolidate_state_data_unchanged', processData.consolidate_state_data)
+    usDataDf = processData.state_store.read()
+    timings.run('consolidate_case_surv_data', processData.consolidate_case_surv_data)
+    timings.run('consolidate_case_surv_data_unchanged', processData.consolidate_case_surv_data)
+
+    timings.run('build_snapshot', snapshot.build_snapshot, snapshot_root, download=False)
+
+    # a cold start in a fresh interpreter
+    env = dict(os.environ, PYTHONPATH=REPO_DIR)
+    output = subprocess.check_output([sys.executable, '-c', STARTUP_SCRIPT], cwd=workdir, env=env)
+    startup = json.loads(output.decode().strip().splitlines()[-1])
+
+    import app
+    client = app.server.test_client()
+    snap = app.snapshots.current()
+    callbacks = time_requests(client, callback_requests(snap),
+                              lambda c, body: c.post('/_dash-update-component', json=body), repeat)
+    api = {}
+    if serve_api:
+        api = time_requests(client, api_requests(snap), lambda c, url: c.get(url), repeat)
+
+    return {'commit': _git_commit(),
+            'timestamp': datetime.datetime.utcnow().isoformat() + 'Z',
+            'machine': {'platform': platform.platform(), 'cpus': os.cpu_count()},
+            'versions': _versions(),
+            'scale': {'days': days, 'states': len(states), 'state_rows': state_rows,
+                      'case_surv_rows': case_surv_rows, 'seed': seed},
+            'rows': {'state_data': len(usDataDf), 'socrata_requests': socrata_requests},
+            'stages': timings.stages,
+            # the same runs split into download, parse, merge, rolling and write
+            'pipeline': telemetry.pipeline_summary(),
+            'startup': startup,
+            'callbacks': callbacks,
+            'api': api}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--days', type=int, default=365, help='days of data from 2020-01-24')
+    parser.add_argument('--surv-rows', type=int, default=1000000, help='case surveillance rows in total')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=5, help='requests per callback input')
+    parser.add_argument('--no-api', action='store_true', help='skip the data api requests')
+    parser.add_argument('--workdir', help='scratch directory, kept when given')
+    parser.add_argument('--output', help='json file written with the results, stdout otherwise')
+    args = parser.parse_args()
+
+    workdir = args.workdir or tempfile.mkdtemp(prefix='covid-bench-')
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+    workdir = os.path.abspath(workdir)
+    output = os.path.abspath(args.output) if args.output else None
+    try:
+        results = run(workdir, args.days, args.surv_rows, args.seed, args.repeat, not args.no_api)
+    finally:
+        os.chdir(REPO_DIR)
+        if args.workdir is None:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    text = json.dumps(results, indent=2)
+    if output is None:
+        print(text)
+    else:
+        with open(output, 'w') as f:
+            f.write(text + '\n')
+        glog.info('Results written to {}'.format(output))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+import os
+
+import pandas as pd
+
+CASE_SURV_DIMENSIONS = ['sex', 'age_group', 'race_ethnicity_combined', 'hosp_yn',
+                        'icu_yn', 'death_yn', 'medcond_yn', 'current_status']
+# row count of a day, the denominator of every breakdown
+TOTAL = '_total'
+CUBE_COLS = ['Date', 'dimension', 'value', 'count']
+
+
+def count_dimensions(df, date, dimensions=CASE_SURV_DIMENSIONS):
+    """category counts of one day of case surveillance rows"""
+
+    parts = [pd.DataFrame({'dimension': [TOTAL], 'value': [''], 'count': [len(df)]})]
+    for dim in dimensions:
+        counts = df[dim].value_counts(dropna=True)
+        parts.append(pd.DataFrame({'dimension': dim,
+                                   'value': counts.index.astype(str),
+                                   'count': counts.values}))
+    out = pd.concat(parts, ignore_index=True)
+    out.insert(0, 'Date', pd.Timestamp(date))
+    out['count'] = out['count'].astype('int64')
+    return out[CUBE_COLS]
+
+
+def merge_counts(counts):
+    """add up count_dimensions outputs, e.g. of the chunks of one file"""
+
+    out = pd.concat(counts, ignore_index=True)
+    out = out.groupby(['Date', 'dimension', 'value'], sort=False)['count'].sum().reset_index()
+    return out[CUBE_COLS]
+
+
+class CaseSurvCube(object):
+    """Per day, per dimension category counts of the case surveillance table
+
+    Answers the breakdown of a dimension in O(categories) instead of a
+    groupby over every surveillance row. Days are replaced as a whole, so
+    re-ingesting a file never double counts.
+    """
+
+    def __init__(self, table=None):
+        self.table = table if table is not None else pd.DataFrame(columns=CUBE_COLS)
+
+    @classmethod
+    def load(cls, filename):
+        if not os.path.exists(filename):
+            return cls()
+        return cls(pd.read_parquet(filename))
+
+    def save(self, filename):
+        tmp_filename = filename + '.tmp'
+        self.table.to_parquet(tmp_filename, index=False)
+        os.replace(tmp_filename, filename)
+
+    def dates(self):
+        return set(pd.to_datetime(self.table['Date']).dt.strftime('%Y-%m-%d'))
+
+    def update(self, counts):
+        """replace the days present in counts (output of count_dimensions)"""
+
+        keep = ~self.table['Date'].isin(counts['Date'].unique())
+        self.table = pd.concat([self.table[keep], counts], ignore_index=True)
+
+    def max_date(self):
+        return pd.to_datetime(self.table['Date']).max()
+
+    def breakdown(self, dimension, start=None, end=None):
+        """share of rows per category of dimension, optionally between two report dates"""
+
+        table = self.table
+        if start is not None:
+            table = table[table['Date'] >= pd.Timestamp(start)]
+        if end is not None:
+            table = table[table['Date'] <= pd.Timestamp(end)]
+        total = table.loc[table['dimension'] == TOTAL, 'count'].sum()
+        counts = table[table['dimension'] == dimension].groupby('value')['count'].sum()
+        out = pd.DataFrame({dimension: counts.index, 'count': counts.values})
+        out['share'] = out['count'] / total if total > 0 else 0.0
+        return out
+
+    def monthly(self, dimension):
+        """category counts of dimension by report month"""
+
+        table = self.table[self.table['dimension'] == dimension]
+        month = pd.to_datetime(table['Date']).dt.to_period('M').astype(str)
+        return table.groupby([month.rename('month'), 'value'])['count'].sum().unstack(fill_value=0)
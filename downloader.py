@@ -0,0 +1,168 @@
+import csv
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import glog
+import requests
+from requests.adapters import HTTPAdapter
+from sodapy import Socrata
+
+CDC_DOMAIN = 'data.cdc.gov'
+PAGE_SIZE = 50000
+MAX_WORKERS = 8
+MAX_RETRIES = 5
+BACKOFF_SECONDS = 1.0
+TIMEOUT_SECONDS = 60
+
+# Empty downloads are written the same way DataFrame().to_csv() writes them,
+# consolidate_* treats any file of 4 bytes or less as empty.
+EMPTY_FILE_CONTENT = '""\n'
+
+
+def socrata_client_factory(domain=CDC_DOMAIN, scheme='https://', pool_size=1,
+                           timeout=TIMEOUT_SECONDS):
+    """Return a factory building Socrata clients on a pooled keep-alive session
+
+    domain/scheme can point the downloader at a local fake Socrata server,
+    e.g. socrata_client_factory('127.0.0.1:8000', 'http://').
+    """
+
+    def factory():
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        return Socrata(domain, None, timeout=timeout,
+                       session_adapter={'prefix': scheme, 'adapter': adapter})
+
+    return factory
+
+
+def _is_retryable(exc):
+    """Connection errors, timeouts, throttling and server errors are retried"""
+
+    if isinstance(exc, requests.exceptions.HTTPError) and exc.response is not None:
+        status = exc.response.status_code
+        return status == 429 or status >= 500
+    return isinstance(exc, requests.exceptions.RequestException)
+
+
+class Downloader(object):
+    """Bounded-concurrency downloader for Socrata datasets
+
+    Every worker thread keeps its own client (and HTTP connection pool) for
+    the lifetime of the downloader, each query is fully paginated and its
+    rows are streamed page by page into the target csv file.
+
+    client_factory is any callable returning an object with the sodapy
+    interface: get(dataset, content_type='csv', query=...) returning a list
+    of csv rows (header first) and close().
+    """
+
+    def __init__(self, client_factory=None, max_workers=MAX_WORKERS,
+                 page_size=PAGE_SIZE, max_retries=MAX_RETRIES,
+                 backoff=BACKOFF_SECONDS):
+        self.client_factory = client_factory or socrata_client_factory()
+        self.max_workers = max_workers
+        self.page_size = page_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self._local = threading.local()
+        self._clients = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """Close every client opened by the worker threads"""
+
+        with self._lock:
+            clients, self._clients = self._clients, []
+            self._local = threading.local()
+        for client in clients:
+            client.close()
+
+    def _client(self):
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self.client_factory()
+            self._local.client = client
+            with self._lock:
+                self._clients.append(client)
+        return client
+
+    def _get_page(self, filesource, dataquery, offset):
+        """Fetch one page of csv rows, retrying with exponential backoff"""
+
+        query = '{} ORDER BY :id LIMIT {} OFFSET {}'.format(dataquery, self.page_size, offset)
+        for attempt in range(self.max_retries + 1):
+            try:
+                rows = self._client().get(filesource, content_type='csv', query=query)
+                # sodapy hands back the raw response when the body is empty
+                return rows if isinstance(rows, list) else []
+            except Exception as exc:
+                if attempt == self.max_retries or not _is_retryable(exc):
+                    raise
+                delay = self.backoff * 2 ** attempt + random.uniform(0, self.backoff)
+                glog.warning('Retrying {} offset {} in {:.1f}s: {}'.format(
+                    filesource, offset, delay, exc))
+                time.sleep(delay)
+
+    def fetch(self, filesource, dataquery, filename):
+        """Download every row matching dataquery into filename, return the row count"""
+
+        tmp_filename = '{}.part'.format(filename)
+        try:
+            nrows = self._stream_to_file(filesource, dataquery, tmp_filename)
+        except Exception:
+            if os.path.exists(tmp_filename):
+                os.remove(tmp_filename)
+            raise
+        # the final name only appears once the download is complete
+        os.replace(tmp_filename, filename)
+        return nrows
+
+    def _stream_to_file(self, filesource, dataquery, filename):
+        nrows = 0
+        with open(filename, 'w', newline='') as f:
+            writer = csv.writer(f)
+            offset = 0
+            while True:
+                page = self._get_page(filesource, dataquery, offset)
+                if len(page) <= 1:
+                    break
+                header, rows = page[0], page[1:]
+                if nrows == 0:
+                    writer.writerow([''] + header)
+                # keep the leading index column DataFrame.to_csv used to write
+                writer.writerows([nrows + i] + row for i, row in enumerate(rows))
+                nrows += len(rows)
+                if len(rows) < self.page_size:
+                    break
+                offset += self.page_size
+            if nrows == 0:
+                f.write(EMPTY_FILE_CONTENT)
+        return nrows
+
+    def fetch_many(self, jobs):
+        """Run (filesource, dataquery, filename) jobs concurrently
+
+        Returns {filename: row count} for the jobs that succeeded, failures
+        are logged and left on disk as missing so the next run retries them.
+        """
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            futures = {executor.submit(self.fetch, *job): job[2] for job in jobs}
+            for future in as_completed(futures):
+                filename = futures[future]
+                try:
+                    results[filename] = future.result()
+                    glog.info('Downloaded {} ({} rows)'.format(filename, results[filename]))
+                except Exception as exc:
+                    glog.error('Failed to download {}: {}'.format(filename, exc))
+        return results
@@ -0,0 +1,76 @@
+import numpy as np
+
+# points a full range line chart is reduced to
+TARGET_POINTS = 150
+
+
+def lttb(x, y, n):
+    """indices of the n points of (x, y) keeping its visual shape, largest triangle three buckets"""
+
+    size = len(x)
+    if n >= size or n < 3:
+        return np.arange(size)
+    x = np.asarray(x, dtype=float)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    # first and last points are kept, the others are split into n - 2 buckets
+    edges = np.linspace(1, size - 1, n - 1).astype(int)
+    indices = np.empty(n, dtype=int)
+    indices[0], indices[-1] = 0, size - 1
+    a = 0
+    for i in range(n - 2):
+        start, end = edges[i], edges[i + 1]
+        if i + 2 < n - 1:
+            next_x = x[edges[i + 1]:edges[i + 2]].mean()
+            next_y = y[edges[i + 1]:edges[i + 2]].mean()
+        else:
+            next_x, next_y = x[-1], y[-1]
+        areas = np.abs((x[a] - next_x) * (y[start:end] - y[a]) - (x[a] - x[start:end]) * (next_y - y[a]))
+        a = start + int(np.argmax(areas))
+        indices[i + 1] = a
+    return indices
+
+
+def minmax(x, y, n):
+    """indices of the lowest and highest point of (n - 2) // 2 equal buckets, first and last kept"""
+
+    size = len(y)
+    if n >= size or n < 4:
+        return np.arange(size)
+    y = np.nan_to_num(np.asarray(y, dtype=float))
+    # first and last points take two of the n, the others are split into buckets of two
+    edges = np.linspace(1, size - 1, (n - 2) // 2 + 1).astype(int)
+    picks = [0, size - 1]
+    for start, end in zip(edges[:-1], edges[1:]):
+        picks.append(start + int(np.argmin(y[start:end])))
+        picks.append(start + int(np.argmax(y[start:end])))
+    return np.unique(picks)
+
+
+METHODS = {'lttb': lttb, 'minmax': minmax}
+
+
+def downsample(df, x_col, y_col, n=TARGET_POINTS, method='lttb'):
+    """rows of df reduced to about n points of the (x_col, y_col) line"""
+
+    if len(df) <= n:
+        return df
+    indices = METHODS[method](df[x_col].values.astype('int64'), df[y_col].values, n)
+    return df.iloc[indices]
+
+
+def x_range(relayout_data):
+    """(start, end) of a zoomed x axis from a graph's relayoutData, None for the full range"""
+
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data:
+        return relayout_data['xaxis.range[0]'], relayout_data['xaxis.range[1]']
+    if 'xaxis.range' in relayout_data:
+        return tuple(relayout_data['xaxis.range'][:2])
+    return None
+
+
+def changes_x(relayout_data):
+    """the relayoutData is a zoom, pan or reset of the x axis"""
+
+    return any(key.startswith('xaxis.range') or key == 'xaxis.autorange' for key in (relayout_data or {}))
@@ -0,0 +1,172 @@
+import functools
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import glog
+import plotly
+
+MAX_BYTES = 64 * 1024 ** 2
+
+
+class FigureCache(object):
+    """LRU cache of serialized figures keyed by (callback, inputs, data version)
+
+    Entries are figure JSON strings, the in-memory LRU is capped at
+    max_bytes. With cache_dir set, entries are also written to
+    <cache_dir>/<version>/ so every gunicorn worker on the host shares them,
+    that directory is capped at max_bytes as well, least recently used
+    files first. Changing the data version drops every entry of the
+    previous version.
+    """
+
+    def __init__(self, max_bytes=MAX_BYTES, cache_dir=None, version=None):
+        self.max_bytes = max_bytes
+        self.cache_dir = cache_dir
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def set_version(self, version):
+        """switch to a new data snapshot, invalidating every cached figure
+
+        Call it after the new data is visible to the callbacks, a figure
+        computed from old data then at worst lands under the old version.
+        """
+
+        with self._lock:
+            if version == self.version:
+                return
+            glog.info('Figure cache version {} -> {}'.format(self.version, version))
+            self.version = version
+            self._entries.clear()
+            self._bytes = 0
+        if self.cache_dir and os.path.isdir(self.cache_dir):
+            for name in os.listdir(self.cache_dir):
+                if name != str(version):
+                    shutil.rmtree(os.path.join(self.cache_dir, name), ignore_errors=True)
+
+    def key(self, name, args, version=None):
+        version = self.version if version is None else version
+        payload = json.dumps([name, list(args), version], sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode()).hexdigest()
+
+    def _disk_path(self, key):
+        return os.path.join(self.cache_dir, str(self.version), key + '.json')
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+        if self.cache_dir:
+            value = self._get_disk(key)
+            if value is not None:
+                self._put_memory(key, value)
+                with self._lock:
+                    self.hits += 1
+                return value
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def _get_disk(self, key):
+        path = self._disk_path(key)
+        try:
+            with open(path) as f:
+                value = f.read()
+            # the mtime orders the files for _trim_disk
+            os.utime(path)
+        except OSError:
+            # missing, or removed by another worker's trim
+            return None
+        return value
+
+    def _trim_disk(self, directory):
+        """remove the least recently used files of directory until it fits in max_bytes"""
+
+        files = []
+        for entry in os.scandir(directory):
+            # files still being written by another worker are left alone
+            if not entry.name.endswith('.json'):
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            files.append((stat.st_mtime, stat.st_size, entry.path))
+        total = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total -= size
+
+    def _put_memory(self, key, value):
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._bytes -= len(self._entries.pop(key))
+            self._entries[key] = value
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    def put(self, key, value, version=None):
+        """store a figure, unless it was computed for a version replaced since"""
+
+        if version is not None and version != self.version:
+            return
+        self._put_memory(key, value)
+        if self.cache_dir and len(value) <= self.max_bytes:
+            path = self._disk_path(key)
+            if not os.path.exists(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'w') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+            # zoomed figures are keyed by their x range, the key space has no bound
+            self._trim_disk(os.path.dirname(path))
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {'version': self.version,
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'hit_rate': self.hits / total if total else 0.0,
+                    'entries': len(self._entries),
+                    'bytes': self._bytes}
+
+    def cached(self, name):
+        """decorator caching the figure (or dict of figures) returned by a Dash callback"""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args):
+                # read the version before the callback reads its data, see set_version
+                version = self.version
+                key = self.key(name, args, version)
+                value = self.get(key)
+                if value is not None:
+                    return json.loads(value)
+                figure = func(*args)
+                self.put(key, json.dumps(figure, cls=plotly.utils.PlotlyJSONEncoder), version)
+                return figure
+            return wrapper
+        return decorator
@@ -0,0 +1,24 @@
+"""gunicorn settings used by the Procfile
+
+The app is imported once in the master and forked into the workers. The
+master drops its snapshot before the first fork, it never serves and
+would otherwise keep the first snapshot mapped after the workers swapped
+to newer ones. Each worker opens the current snapshot right after the
+fork and loads it on a thread, nothing slow runs before it checks in
+with the master. On a fresh dyno with no snapshot the first build starts
+at boot, in the background, while the port is already bound.
+"""
+
+preload_app = True
+# builds and snapshot loads run on threads, a worker silent this long is hung
+timeout = 60
+
+
+def when_ready(server):
+    import app
+    app.snapshots.release()
+
+
+def post_fork(server, worker):
+    import app
+    app.snapshots.ensure_started()
@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+
+
+def index_order(usDataDf, state_col='state', date_col='Date'):
+    """positions sorting the table by (state, Date), the layout of StateSeriesIndex"""
+
+    return np.lexsort((usDataDf[date_col].values, usDataDf[state_col].astype(str).values))
+
+
+class StateSeriesIndex(object):
+    """Per state, date sorted time series of the state table
+
+    The table is sorted once by (state, Date) into contiguous numpy arrays,
+    a lookup returns a view of one state's slice, no scan, sort or copy.
+    Build a new index whenever the table is reloaded.
+    """
+
+    def __init__(self, usDataDf, columns, state_col='state', date_col='Date'):
+        states = usDataDf[state_col].astype(str).values
+        dates = usDataDf[date_col].values
+        order = index_order(usDataDf, state_col, date_col)
+        if (order == np.arange(len(order))).all():
+            # already in index order, e.g. a memory mapped snapshot, keep the arrays shared
+            order = slice(None)
+        states = states[order]
+        self.date_col = date_col
+        self._dates = np.ascontiguousarray(dates[order])
+        self._columns = {col: np.ascontiguousarray(np.asarray(usDataDf[col].values)[order]) for col in columns}
+        names, starts = np.unique(states, return_index=True)
+        ends = np.append(starts[1:], len(states))
+        self._slices = {name: slice(start, end) for name, start, end in zip(names, starts, ends)}
+        self._empty = slice(0, 0)
+
+    def states(self):
+        return sorted(self._slices)
+
+    def columns(self):
+        return list(self._columns)
+
+    def _slice(self, state, start=None, end=None):
+        """slice of state narrowed to the dates between start and end (inclusive)"""
+
+        part = self._slices.get(state, self._empty)
+        dates = self._dates[part]
+        lo = np.searchsorted(dates, np.datetime64(start, 'ns')) if start is not None else 0
+        hi = np.searchsorted(dates, np.datetime64(end, 'ns'), side='right') if end is not None else len(dates)
+        return slice(part.start + lo, part.start + max(lo, hi))
+
+    def frame(self, state, columns, start=None, end=None):
+        """Date plus columns of one state, built straight from the index slices"""
+
+        part = self._slice(state, start, end)
+        data = {self.date_col: self._dates[part]}
+        data.update((col, self._columns[col][part]) for col in columns)
+        return pd.DataFrame(data)
@@ -0,0 +1,111 @@
+"""Record of the raw CDC files ingested into the stores
+
+CDC republishes days with corrections, so a day is (re)ingested when its
+file is new or its content changed since it was ingested, not only when the
+day is missing from the store.
+"""
+import csv
+import datetime
+import hashlib
+import json
+import os
+
+import glog
+
+MANIFEST_FILE = './ProdData/ingest_manifest.json'
+
+
+def file_hash(filename, block_size=1024 ** 2):
+    sha = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+
+def count_rows(filename):
+    """data rows of a csv file, header excluded"""
+
+    with open(filename, newline='') as f:
+        return max(sum(1 for _ in csv.reader(f)) - 1, 0)
+
+
+def file_date(filename):
+    return os.path.basename(filename).split('.')[0][-10:]
+
+
+class Manifest(object):
+    """Date, size, hash, row count and ingest time of every ingested raw file
+
+    Entries are kept per dataset (the raw file folder) and day. A file whose
+    size and mtime match its entry is not hashed again.
+    """
+
+    def __init__(self, filename=MANIFEST_FILE):
+        self.filename = filename
+        self.entries = {}
+        if os.path.exists(filename):
+            with open(filename) as f:
+                self.entries = json.load(f)
+
+    def entry(self, dataset, date):
+        return self.entries.get(dataset, {}).get(date)
+
+    def _fingerprint(self, dataset, date, filename):
+        stat = os.stat(filename)
+        entry = self.entry(dataset, date)
+        if entry is not None and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+            return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': entry['sha1']}
+        return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': file_hash(filename)}
+
+    def changed(self, dataset, date, filename):
+        """the file differs from the one ingested for this day"""
+
+        entry = self.entry(dataset, date)
+        if entry is None:
+            return True
+        fingerprint = self._fingerprint(dataset, date, filename)
+        if fingerprint['sha1'] == entry['sha1']:
+            # same content downloaded again, remember the new mtime
+            entry['mtime_ns'] = fingerprint['mtime_ns']
+            return False
+        return True
+
+    def record(self, dataset, date, filename, rows):
+        entry = self._fingerprint(dataset, date, filename)
+        entry.update(date=date, rows=rows,
+                     ingested_at=datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'))
+        self.entries.setdefault(dataset, {})[date] = entry
+
+    def pending(self, dataset, path, stored):
+        """sorted dates of the files in path that are new or changed
+
+        Days already stored but missing from the manifest were ingested
+        before it existed, their current files are recorded as ingested.
+        """
+
+        files = {file_date(file): os.path.join(path, file) for file in os.listdir(path)
+                 if file.endswith('.csv')}
+        dates = []
+        for date in sorted(files):
+            entry = self.entry(dataset, date)
+            if entry is None and date in stored:
+                self.record(dataset, date, files[date], None)
+            elif entry is None or self.changed(dataset, date, files[date]):
+                dates.append(date)
+            elif date not in stored and entry['rows'] != 0:
+                # ingested, then lost from the store
+                dates.append(date)
+        revised = [date for date in dates if date in stored]
+        if len(revised) > 0:
+            glog.info('Revised files in {}: {}'.format(path, revised))
+        return dates
+
+    def save(self):
+        directory = os.path.dirname(self.filename)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        tmp_filename = '{}.{}.tmp'.format(self.filename, os.getpid())
+        with open(tmp_filename, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_filename, self.filename)
@@ -0,0 +1,151 @@
+"""Derived metrics of the state table, declared once and evaluated together
+
+A metric names its inputs, an operation and, for windowed metrics, the
+window evaluated within each state. evaluate() reads every input column
+once as a NumPy array and computes all metrics in declaration order, so a
+metric can use the metrics declared before it.
+"""
+import numpy as np
+import pandas as pd
+
+
+class Metric(object):
+    """One derived column
+
+    op is 'ratio' (scale * inputs[0] / inputs[1]), 'mean' (mean of the last
+    window rows of the same state, ignoring missing values) or 'tier' (the
+    label of the bins interval the input falls in). decimals rounds the
+    result and fill replaces missing results.
+    """
+
+    def __init__(self, name, op, inputs, window=None, scale=1.0, decimals=None, fill=None,
+                 bins=None, labels=None):
+        if op not in OPS:
+            raise ValueError('Unknown metric operation {}'.format(op))
+        self.name = name
+        self.op = op
+        self.inputs = list(inputs)
+        self.window = window
+        self.scale = scale
+        self.decimals = decimals
+        self.fill = fill
+        self.bins = bins
+        self.labels = labels
+
+
+def _ratio(metric, values, groups):
+    num, den = values
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (metric.scale * num) / den
+
+
+def _mean(metric, values, groups):
+    """rolling mean over the previous rows of each group, in table order"""
+
+    codes, order, row_start = groups
+    values = values[0][order]
+    n = len(values)
+    rows = np.arange(n)
+    total = np.zeros(n)
+    count = np.zeros(n)
+    for lag in range(metric.window):
+        prev = rows - lag
+        inside = prev >= row_start
+        lagged = values[np.where(inside, prev, 0)]
+        use = inside & ~np.isnan(lagged)
+        total += np.where(use, lagged, 0.0)
+        count += use
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = np.where(count > 0, total / count, np.nan)
+    out = np.empty(n)
+    out[order] = mean
+    # rows without a group have no window, like a pandas groupby
+    out[codes < 0] = np.nan
+    return out
+
+
+def _tier(metric, values, groups):
+    values = values[0]
+    labels = np.array(metric.labels, dtype=object)
+    out = labels[np.digitize(np.nan_to_num(values), metric.bins)]
+    out[np.isnan(values)] = None
+    return out
+
+
+OPS = {'ratio': _ratio, 'mean': _mean, 'tier': _tier}
+
+
+def _groups(keys):
+    """group codes, a stable order putting groups together and each row's group start"""
+
+    codes, _ = pd.factorize(keys)
+    order = np.argsort(codes, kind='mergesort')
+    sorted_codes = codes[order]
+    starts = np.r_[0, np.flatnonzero(sorted_codes[1:] != sorted_codes[:-1]) + 1]
+    row_start = np.repeat(starts, np.diff(np.r_[starts, len(codes)]))
+    return codes, order, row_start
+
+
+def history(metrics):
+    """rows of earlier data per state needed to evaluate the metrics on new rows"""
+
+    needed = {}
+    for metric in metrics:
+        inputs = max([needed.get(col, 0) for col in metric.inputs] + [0])
+        needed[metric.name] = inputs + (metric.window - 1 if metric.window else 0)
+    return max(list(needed.values()) + [0])
+
+
+def evaluate(df, metrics, group_col='state'):
+    """a copy of df with every metric added, windowed metrics need date sorted rows"""
+
+    arrays = {}
+    groups = None
+    for metric in metrics:
+        for col in metric.inputs:
+            if col not in arrays:
+                arrays[col] = pd.to_numeric(df[col]).to_numpy(dtype=float, na_value=np.nan)
+        if metric.window and groups is None:
+            groups = _groups(df[group_col].to_numpy())
+        result = OPS[metric.op](metric, [arrays[col] for col in metric.inputs], groups)
+        if metric.decimals is not None:
+            result = np.round(result, metric.decimals)
+        if metric.fill is not None:
+            result = np.where(pd.isnull(result), metric.fill, result)
+        arrays[metric.name] = result
+    return df.assign(**{metric.name: arrays[metric.name] for metric in metrics})
+
+
+def format_thousands(s):
+    """whole numbers with thousands separators, e.g. 1311625.0 -> '1,311,625'"""
+
+    values = pd.to_numeric(s).round()
+    text = values.astype('Int64').astype(str).str.replace(r'\B(?=(\d{3})+(?!\d))', ',', regex=True)
+    return text.where(values.notna(), '')
+
+
+def format_percent(s, decimals=2):
+    """values already in percent to text, e.g. 0.2912 -> '0.29%'"""
+
+    values = pd.to_numeric(s)
+    text = pd.Series(np.char.mod('%.{}f%%'.format(decimals), values.to_numpy(dtype=float)), index=s.index)
+    return text.where(values.notna(), '')
+
+
+STATE_DAILY_METRICS = [
+    Metric('case fatality rate', 'ratio', ['tot_death', 'tot_cases'], fill=0),
+    Metric('death rate', 'ratio', ['tot_death', 'Population'], scale=100.0, decimals=8, fill=0),
+    Metric('Total Cases per Population', 'ratio', ['tot_cases', 'Population']),
+    Metric('New Cases per Population', 'ratio', ['new_case', 'Population']),
+]
+
+# CA Blueprint for a Safer Economy tiers of the adjusted case rate
+RISK_LEVELS = ['Minimal Tier 4', 'Moderate Tier 3', 'Substantial Tier 2', 'Widespread Tier 1']
+
+STATE_ROLLING_METRICS = [
+    Metric('7 day average new cases', 'mean', ['new_case'], window=7, decimals=0),
+    Metric('Adjusted Case Rate', 'ratio', ['7 day average new cases', 'Population'],
+           scale=100000.0, decimals=0),
+    # rows without a rate are labelled '0', as np.select labelled them before
+    Metric('Risk Level', 'tier', ['Adjusted Case Rate'], bins=[1.0, 4.0, 7.0], labels=RISK_LEVELS, fill='0'),
+]
@@ -1,10 +1,20 @@
+import bisect
 import datetime
 import glog
-import numpy as np
+import hashlib
+import json
+import multiprocessing
 import os
 import pandas as pd
 import pdb
-from sodapy import Socrata
+from concurrent.futures import ProcessPoolExecutor
+
+import cube
+import downloader
+import manifest
+import metrics
+import storage
+import telemetry
 
 usStateDataLink = "9mfq-cb36"
 usDeathDataLink = '9bhg-hcku'
@@ -13,24 +23,42 @@ caseSurveillanceData = 'vbim-akqf'
 us_state_data_query = "SELECT * WHERE submission_date="
 case_surveillance_query = "SELECT * WHERE cdc_report_dt="
 
+population_html = './data/pop.html'
+state_code_file = 'StateCode.csv'
+population_cache_file = './data/population_cache.json'
+# regions reported by CDC that are not rows of the wikipedia table
+population_overrides = {'NYC': 8336817}
+
+state_store = storage.PartitionedStore('./ProdData/USDatabyStates', storage.STATE_SCHEMA)
+case_surv_store = storage.PartitionedStore('./ProdData/CaseSurvData', storage.CASE_SURV_SCHEMA)
+case_surv_cube_file = './ProdData/CaseSurvCube.parquet'
+manifest_file = manifest.MANIFEST_FILE
+
+# recent days downloaded again on every check, CDC revises them after publishing
+REFETCH_DAYS = int(os.environ.get('REFETCH_DAYS', 7))
+
+# compiled population tables loaded by this process, keyed by input file stats
+_population_tables = {}
 
-def download_file(date, filesource, dataquery, filename_prefix, folder):
+
+def download_file(date, filesource, dataquery, filename_prefix, folder, client=None):
     """Download data from CDC website"""
 
-    client = Socrata("data.cdc.gov", None)
-    results = client.get(filesource, query=dataquery)
-    results_df = pd.DataFrame.from_records(results)
     filename = './{}/{}-{}.csv'.format(folder, filename_prefix, date)
-    results_df.to_csv(filename)
+    if client is not None:
+        return client.fetch(filesource, dataquery, filename)
+    with downloader.Downloader() as client:
+        return client.fetch(filesource, dataquery, filename)
 
 
-def process_population_data(input_file):
+def process_population_data(input_file, code_file=state_code_file):
     """function to convert wikipedia us population data"""
 
     df = pd.read_html(input_file)
-    newdf = df[0][['State', 'Population estimate, July 1, 2019[2]']]
+    pop_col = [c for c in df[0].columns if c.startswith('Population estimate, July 1, 2019')][0]
+    newdf = df[0][['State', pop_col]]
     newdf.columns = ['State', 'Population']
-    code = pd.read_csv('StateCode.csv')
+    code = pd.read_csv(code_file)
     merge = pd.merge(left=newdf, right=code, left_on='State', right_on='Name', how='outer')
     merge.loc[merge['State'] == 'U.S. Virgin Islands', 'State or Region Code'] = 'VI'
     merge.loc[merge['State'] == 'District of Columbia', 'State or Region Code'] = 'DC'
@@ -44,139 +72,354 @@ def process_population_data(input_file):
     return output
 
 
-def check_download(date, filesource, dataquery, filenamePrefix, folder):
-    """Daily checker to see how if files have been updated on CDC website"""
+def _files_hash(files):
+    sha = hashlib.sha1()
+    for file in files:
+        with open(file, 'rb') as f:
+            sha.update(f.read())
+    sha.update(json.dumps(population_overrides, sort_keys=True).encode())
+    return sha.hexdigest()
+
+
+def load_population(input_file=population_html, code_file=state_code_file,
+                    cache_file=population_cache_file):
+    """population by state or region code, overrides included
+
+    The html and code table are compiled once into cache_file, keyed by the
+    hash of both inputs, and the table is kept in memory for the rest of the
+    process. Either is rebuilt only when an input file changes.
+    """
+
+    stats = tuple((os.stat(f).st_mtime_ns, os.stat(f).st_size) for f in (input_file, code_file))
+    key = (input_file, code_file, stats)
+    if key not in _population_tables:
+        source_hash = _files_hash([input_file, code_file])
+        cache = {}
+        if os.path.exists(cache_file):
+            with open(cache_file) as f:
+                cache = json.load(f)
+        if cache.get('source_hash') != source_hash:
+            glog.info('Compiling population table from {}'.format(input_file))
+            output = process_population_data(input_file, code_file)
+            population = dict(zip(output['State or Region Code'], output['Population'].astype(float)))
+            population.update(population_overrides)
+            cache = {'source_hash': source_hash, 'population': population}
+            with open(cache_file, 'w') as f:
+                json.dump(cache, f)
+        pop = pd.DataFrame({'State or Region Code': list(cache['population'].keys()),
+                            'Population': list(cache['population'].values())})
+        pop['Population'] = pop['Population'].astype(float)
+        _population_tables[key] = pop
+
+    return _population_tables[key].copy()
+
+
+def check_download(date, filesource, dataquery, filenamePrefix, folder, client=None,
+                   refetch_days=REFETCH_DAYS):
+    """Daily checker to see how if files have been updated on CDC website
+
+    Missing days are downloaded, and so are the last refetch_days days
+    already on disk, the days CDC still revises. A refetched file that did
+    not change is not ingested again (see manifest.py).
+    """
 
     # Create folder if not exist
     if not os.path.exists(folder):
         os.makedirs(folder)
     # Download State Data
     daterange = pd.date_range('2020-01-24', date)
-    
-    datelist = [datetime.datetime.strptime(file.split(
-        '.')[0][-10:], '%Y-%m-%d') for file in os.listdir(folder)]
+
+    datelist = set(datetime.datetime.strptime(file.split(
+        '.')[0][-10:], '%Y-%m-%d') for file in os.listdir(folder) if file.endswith('.csv'))
     missing_dates = [d for d in daterange if d not in datelist]
+    recent = daterange[-refetch_days:] if refetch_days > 0 else []
+    refetch_dates = [d for d in recent if d in datelist]
     glog.info('Missing dates {}'.format(missing_dates))
-    for dt in missing_dates:
-        query = "{}'{}'".format(dataquery, dt.date())
-        download_file(dt.date(), filesource, query, filenamePrefix, folder)
+    glog.info('Refetching dates {}'.format(refetch_dates))
+    jobs = [(filesource,
+             "{}'{}'".format(dataquery, dt.date()),
+             './{}/{}-{}.csv'.format(folder, filenamePrefix, dt.date())) for dt in missing_dates + refetch_dates]
+    with telemetry.stage('download', dataset=folder):
+        if client is not None:
+            results = client.fetch_many(jobs)
+        else:
+            with downloader.Downloader() as client:
+                results = client.fetch_many(jobs)
+    telemetry.count_rows('download', sum(results.values()), dataset=folder)
     glog.info('Done Downloading files')
 
 
-def consolidate_state_data():
-    """combine daily files to one consolidated file """
+STATE_COLS = ['Date', 'state', 'tot_cases', 'new_case', 'tot_death', 'new_death',
+    'submission_date', 'case fatality rate', 'State or Region Code',
+    'Population', 'death rate', 'Total Cases per Population',
+    'New Cases per Population']
+STATE_ROLLING_COLS = [metric.name for metric in metrics.STATE_ROLLING_METRICS]
+# rows of history per state the rolling metrics of a new day depend on
+ROLLING_WINDOW = metrics.history(metrics.STATE_ROLLING_METRICS) + 1
+
+
+def process_state_file(path, file):
+    """read one daily state file and add the per day columns"""
+
+    dt = os.path.basename(file).split('.')[0][-10:]
+    df = pd.read_csv(os.path.join(path, file))
+    df['Date'] = dt
+
+    df[['tot_cases', 'new_case', 'tot_death', 'new_death']] = df[[
+        'tot_cases', 'new_case', 'tot_death', 'new_death']].apply(pd.to_numeric)
+    df.loc['US'] = df.sum(numeric_only=True)
+    df.loc['US', 'state'] = 'US'
+    df.loc['US', 'Date'] = dt
+    df.loc['US', 'submission_date'] = dt
+
+    pop = load_population()
+    test = pd.merge(
+        left=df,
+        right=pop,
+        left_on='state',
+        right_on='State or Region Code',
+        how='outer')
+
+    test = metrics.evaluate(test, metrics.STATE_DAILY_METRICS)
+
+    return test[STATE_COLS]
+
+
+def add_rolling_metrics(usDataDf):
+    """7 day average, adjusted case rate and risk level per state, rows must be date sorted"""
+
+    return metrics.evaluate(usDataDf, metrics.STATE_ROLLING_METRICS)
+
+
+def state_tail(usDataDf, n=ROLLING_WINDOW - 1):
+    """last n rows of every state, enough history to extend the rolling window"""
+
+    usDataDf = usDataDf.sort_values(by='Date', kind='mergesort')
+    return usDataDf.groupby('state').tail(n)
+
+
+def read_state_tail(states, n=ROLLING_WINDOW - 1, before=None):
+    """state_tail read from the newest partitions (before a date) of the state store only"""
+
+    dates = [d for d in state_store.dates() if before is None or d < before]
+    if len(dates) == 0:
+        return storage.STATE_SCHEMA.empty_table().to_pandas()
+    tail = state_tail(state_store.read(start=dates[-n] if len(dates) >= n else None, end=dates[-1]), n)
+    counts = tail.groupby('state').size()
+    complete = counts.reindex(list(states)).fillna(0) >= n
+    if len(dates) > n and not complete.all():
+        # a state skipped days recently, its window reaches further back
+        tail = state_tail(state_store.read(end=dates[-1]), n)
+    return tail
+
+
+def affected_dates(dates, changed, n=ROLLING_WINDOW):
+    """changed days and the n - 1 days after each, whose rolling windows include them"""
+
+    dates = sorted(dates)
+    affected = set()
+    for dt in changed:
+        i = bisect.bisect_left(dates, dt)
+        # a day that is gone only shifts the windows of the days after it
+        affected.update(dates[i:i + (n if i < len(dates) and dates[i] == dt else n - 1)])
+    return sorted(affected)
+
+
+def consolidate_state_data(incremental=True, load=False):
+    """combine daily files to one consolidated table in the state store
+
+    New days and days whose file changed since it was ingested (see
+    manifest.py) are processed. With incremental=True, only those days and
+    the days whose rolling window includes one of them are recomputed, from
+    the last ROLLING_WINDOW - 1 rows of each state before them, and
+    rewritten. A first build or incremental=False recomputes the full
+    history. Nothing is read back and None is returned, load=True returns
+    the whole consolidated table.
+    """
 
     path = './StateData'
-    cols = ['Date', 'state', 'tot_cases', 'new_case', 'tot_death', 'new_death',
-       'submission_date', 'case fatality rate', 'State or Region Code',
-       'Population', 'death rate', 'Total Cases per Population',
-       'New Cases per Population']
-    if os.path.exists('./ProdData/USDatabyStates.csv') and os.stat('./ProdData/USDatabyStates.csv').st_size > 4:
-        usDataDf = pd.read_csv('./ProdData/USDatabyStates.csv')
-    else:
-        usDataDf = pd.DataFrame(columns=cols)
-
-    datelist = usDataDf.Date.unique()
-    stateDataDtList = [os.path.basename(file).split('.')[0][-10:] for file in os.listdir('./StateData')]
-    missingdates = [i for i in stateDataDtList if i not in datelist]
-    missingFiles = ['US-State-Data-{}.csv'.format(dt) for dt in missingdates]
-    
-    if len(missingFiles)>0:
-        for file in missingFiles:
-            if os.stat(os.path.join(path,file)).st_size <= 4:
-                glog.info('File {} is empty'.format(file))
-            else:
-                dt = os.path.basename(file).split('.')[0][-10:]
-                df = pd.read_csv(os.path.join(path, file))
-                df['Date'] = dt
-                
-                df[['tot_cases', 'new_case', 'tot_death', 'new_death']] = df[[
-                    'tot_cases', 'new_case', 'tot_death', 'new_death']].apply(pd.to_numeric)
-                df.loc['US'] = df.sum(numeric_only=True)
-                df.loc['US', 'state'] = 'US'
-                df.loc['US', 'Date'] = dt
-                df.loc['US', 'submission_date'] = dt
-
-                df['case fatality rate'] = df['tot_death'].astype(float) / df['tot_cases'].astype(float)
-                df['case fatality rate'] = df['case fatality rate'].fillna(0)
-                
-                pop = process_population_data('./data/pop.html')
-                newrow = {'State or Region Code': 'NYC', 'Population': 8336817}
-                pop = pop.append(newrow, ignore_index=True)
-                test = pd.merge(
-                    left=df,
-                    right=pop,
-                    left_on='state',
-                    right_on='State or Region Code',
-                    how='outer')
-
-                test['death rate'] = round((100.0*test['tot_death'].astype(float)) / test['Population'],8)
-                test['death rate'] = test['death rate'].fillna(0)
-
-                test['Total Cases per Population'] = test['tot_cases'] / test['Population']
-                test['New Cases per Population'] = test['new_case'] / test['Population']
-                
-                usDataDf = usDataDf.append(test[cols])
-
-        usDataDf['Date'] = usDataDf['Date'].apply(pd.to_datetime)
-        usDataDf = usDataDf.sort_values(by='Date')
-        usDataDf = usDataDf.set_index('Date')
-
-        usDataDf['7 day average new cases'] = usDataDf.groupby('state')['new_case'].transform(lambda x: x.rolling(7, 1).mean())
-        usDataDf['7 day average new cases'] = round(usDataDf['7 day average new cases'],0)
-        usDataDf['Adjusted Case Rate'] = round(100000 * usDataDf['7 day average new cases'] / usDataDf['Population'],0)
-        usDataDf = usDataDf.reset_index()
-
-        col = 'Adjusted Case Rate'
-        conditions = [(usDataDf[col] < 1.0),
-                    (usDataDf[col] >= 1.0) & (usDataDf[col] < 4.0),
-                    (usDataDf[col] >= 4.0) & (usDataDf[col] < 7.0),
-                    (usDataDf[col] >= 7.0)]
-        values = ['Minimal Tier 4', 'Moderate Tier 3', 'Substantial Tier 2', 'Widespread Tier 1']
-        usDataDf['Risk Level'] = np.select(conditions, values)
-        usDataDf = usDataDf.dropna(subset=['Population', 'State or Region Code'])
-
-
-        prod_data_folder = './ProdData'
-        if not os.path.exists(prod_data_folder):
-            os.makedirs(prod_data_folder)
-        
-        cols += ['7 day average new cases','Adjusted Case Rate','Risk Level']
-        usDataDf[cols].to_csv('{}/USDatabyStates.csv'.format(prod_data_folder), index=False)
-
-    return usDataDf
-
-
-def consolidate_case_surv_data():
-    """ consolidate case surveillance data"""
+    state_store.migrate_csv('./ProdData/USDatabyStates.csv')
+
+    ingest_manifest = manifest.Manifest(manifest_file)
+    datelist = set(state_store.dates())
+    pendingdates = ingest_manifest.pending('StateData', path, datelist)
+
+    newDfs = []
+    removed = []
+    for dt in pendingdates:
+        file = 'US-State-Data-{}.csv'.format(dt)
+        if os.stat(os.path.join(path,file)).st_size <= 4:
+            glog.info('File {} is empty'.format(file))
+            ingest_manifest.record('StateData', dt, os.path.join(path, file), 0)
+            if dt in datelist:
+                state_store.remove(dt)
+                removed.append(dt)
+        else:
+            with telemetry.stage('parse', dataset='StateData'):
+                newDfs.append(process_state_file(path, file))
+            telemetry.count_rows('parse', len(newDfs[-1]), dataset='StateData')
+            ingest_manifest.record('StateData', dt, os.path.join(path, file),
+                                   manifest.count_rows(os.path.join(path, file)))
+
+    if len(newDfs) > 0 or len(removed) > 0:
+        newDf = pd.concat(newDfs) if len(newDfs) > 0 else pd.DataFrame(columns=STATE_COLS)
+        newDf['Date'] = pd.to_datetime(newDf['Date'])
+        changed = sorted(set(newDf['Date'].dropna().dt.strftime('%Y-%m-%d')) | set(removed))
+
+        cols = STATE_COLS + STATE_ROLLING_COLS
+        if incremental and len(datelist - set(changed)) > 0:
+            dates = affected_dates((datelist | set(changed)) - set(removed), changed)
+            glog.info('Recomputing {} days for {} new or revised days'.format(len(dates), len(changed)))
+            if len(dates) > 0:
+                with telemetry.stage('merge', dataset='StateData'):
+                    stored = state_store.read(start=dates[0], end=dates[-1], columns=STATE_COLS)
+                    stored = stored[~stored['Date'].dt.strftime('%Y-%m-%d').isin(changed)]
+                    # rows without a population (FSM, PW, RMI) are never stored, asking
+                    # for their tail would fall back to reading the whole history
+                    stored_states = newDf.loc[newDf['Population'].notnull(), 'state'].dropna()
+                    states = set(stored['state'].dropna()) | set(stored_states)
+                    tail = read_state_tail(states, before=dates[0])[STATE_COLS]
+                    newDf = pd.concat([tail, stored, newDf]).sort_values(by='Date', kind='mergesort')
+                with telemetry.stage('rolling', dataset='StateData'):
+                    newDf = add_rolling_metrics(newDf)
+                newDf = newDf[newDf['Date'].dt.strftime('%Y-%m-%d').isin(dates)]
+        else:
+            glog.info('Rebuilding state data with {} new days'.format(len(newDfs)))
+            with telemetry.stage('merge', dataset='StateData'):
+                stored = state_store.read(columns=STATE_COLS)
+                stored = stored[~stored['Date'].dt.strftime('%Y-%m-%d').isin(changed)]
+                newDf = pd.concat([stored, newDf])
+                newDf = newDf.sort_values(by='Date', kind='mergesort')
+            with telemetry.stage('rolling', dataset='StateData'):
+                newDf = add_rolling_metrics(newDf).reset_index(drop=True)
+        newDf = newDf.dropna(subset=['Population', 'State or Region Code'])
+        with telemetry.stage('write', dataset='StateData'):
+            state_store.write(newDf[cols])
+        telemetry.count_rows('write', len(newDf), dataset='StateData')
+
+    ingest_manifest.save()
+    if load:
+        return state_store.read()
+
+
+CASE_SURV_COLS = ['Date','cdc_report_dt', 'onset_dt', 'current_status', 'sex',
+    'age_group', 'race_ethnicity_combined', 'hosp_yn', 'icu_yn', 'death_yn',
+    'medcond_yn']
+# every raw column is read as a string, no type inference
+CASE_SURV_DTYPES = {col: str for col in CASE_SURV_COLS[1:]}
+# rows of a daily file held in memory at once while ingesting
+CASE_SURV_CHUNKSIZE = 100000
+# processes parsing daily files in parallel, 1 ingests in this process. Each one is
+# a fresh interpreter holding a chunk, and cpu_count() is the host's on a dyno,
+# so the default stays small next to the serving workers
+CASE_SURV_WORKERS = int(os.environ.get('CASE_SURV_WORKERS', min(2, os.cpu_count() or 1)))
+
+
+def load_case_surv_cube():
+    """case surveillance cube, counting any stored day it does not cover yet"""
+
+    case_cube = cube.CaseSurvCube.load(case_surv_cube_file)
+    missing = sorted(set(case_surv_store.dates()) - case_cube.dates())
+    for dt in missing:
+        df = case_surv_store.read(start=dt, end=dt, columns=cube.CASE_SURV_DIMENSIONS)
+        case_cube.update(cube.count_dimensions(df, dt))
+    if len(missing) > 0:
+        glog.info('Added {} days to the case surveillance cube'.format(len(missing)))
+        case_cube.save(case_surv_cube_file)
+    return case_cube
+
+
+def read_case_surv_file(path, file, chunksize=CASE_SURV_CHUNKSIZE):
+    """yield the needed columns of a daily case surveillance file, chunksize rows at a time"""
+
+    dt = os.path.basename(file).split('.')[0][-10:]
+    for df in pd.read_csv(os.path.join(path, file), usecols=CASE_SURV_COLS[1:],
+                          dtype=CASE_SURV_DTYPES, chunksize=chunksize):
+        df['Date'] = pd.Timestamp(dt)
+        yield df[CASE_SURV_COLS]
+
+
+def ingest_case_surv_file(path, file, chunksize=CASE_SURV_CHUNKSIZE):
+    """stream a daily file into its store partition, return its cube counts"""
+
+    dt = os.path.basename(file).split('.')[0][-10:]
+    counts = []
+
+    def chunks():
+        for df in read_case_surv_file(path, file, chunksize):
+            counts.append(cube.count_dimensions(df, dt))
+            yield df
+
+    case_surv_store.write_chunks(dt, chunks())
+    if len(counts) == 0:
+        counts.append(cube.count_dimensions(pd.DataFrame(columns=CASE_SURV_COLS), dt))
+    return cube.merge_counts(counts)
+
+
+def measure_case_surv_file(path, file, chunksize=CASE_SURV_CHUNKSIZE):
+    """ingest_case_surv_file timed in the process running it, see telemetry.measure"""
+
+    return telemetry.measure(ingest_case_surv_file, path, file, chunksize)
+
+
+def consolidate_case_surv_data(chunksize=CASE_SURV_CHUNKSIZE, load=False, workers=CASE_SURV_WORKERS):
+    """ consolidate case surveillance data, one store partition per daily file
+
+    Daily files are streamed chunksize rows at a time and only new or
+    revised days (see manifest.py) are written, so peak memory depends on chunksize and not on the size of
+    the consolidated data. Up to workers processes each parse and write
+    their own days, the counts are merged into the cube in date order.
+    Nothing is read back and None is returned, the cube answers the
+    dashboard breakdowns. load=True returns the whole consolidated table.
+    """
 
     path = './CaseSurveillanceData'
-    cols = ['Date','cdc_report_dt', 'onset_dt', 'current_status', 'sex',
-       'age_group', 'race_ethnicity_combined', 'hosp_yn', 'icu_yn', 'death_yn',
-       'medcond_yn']
-
-    if os.path.exists('./ProdData/CaseSurvData.csv') and os.stat('./ProdData/CaseSurvData.csv').st_size > 4:
-        cons_df = pd.read_csv('./ProdData/CaseSurvData.csv')
-    else:
-        cons_df = pd.DataFrame(columns=cols)
-
-    datelist = cons_df.Date.unique()
-    caseDataDtList = [os.path.basename(file).split('.')[0][-10:] for file in os.listdir(path)]
-    missingdates = [i for i in caseDataDtList if i not in datelist]
-    missingFiles = ['Case-Surveillance-{}.csv'.format(dt) for dt in missingdates]
-
-    if len(missingFiles)>0:
-        for file in missingFiles:
-            if os.stat(os.path.join(path,file)).st_size <= 4:
-                glog.info('File {} is empty'.format(file))
-                
-            else:
-                dt = os.path.basename(file).split('.')[0][-10:]
-                df = pd.read_csv(os.path.join(path, file))
-                df['Date'] = dt
-            
-                cons_df = cons_df.append(df[cols])
-    
-        cons_df.to_csv('./ProdData/CaseSurvData.csv', index=False)
-    
-    return cons_df
\ No newline at end of file
+    case_surv_store.migrate_csv('./ProdData/CaseSurvData.csv', chunksize=chunksize)
+    case_cube = load_case_surv_cube()
+
+    ingest_manifest = manifest.Manifest(manifest_file)
+    datelist = set(case_surv_store.dates())
+    pendingdates = ingest_manifest.pending('CaseSurveillanceData', path, datelist)
+
+    files = []
+    for dt in pendingdates:
+        file = 'Case-Surveillance-{}.csv'.format(dt)
+        if os.stat(os.path.join(path,file)).st_size <= 4:
+            glog.info('File {} is empty'.format(file))
+            ingest_manifest.record('CaseSurveillanceData', dt, os.path.join(path, file), 0)
+            if dt in datelist:
+                case_surv_store.remove(dt)
+                case_cube.update(cube.count_dimensions(pd.DataFrame(columns=CASE_SURV_COLS), dt))
+        else:
+            files.append(file)
+
+    def ingested(file, counts, seconds, rss, rss_growth):
+        # parsing and writing the partition, timed in the worker
+        telemetry.observe_stage('ingest', seconds, rss, rss_growth, dataset='CaseSurveillanceData')
+        rows = int(counts.loc[counts['dimension'] == cube.TOTAL, 'count'].sum())
+        telemetry.count_rows('ingest', rows, dataset='CaseSurveillanceData')
+        ingest_manifest.record('CaseSurveillanceData', manifest.file_date(file), os.path.join(path, file), rows)
+        with telemetry.stage('merge', dataset='CaseSurveillanceData'):
+            case_cube.update(counts)
+
+    if len(files) > 0:
+        workers = max(1, min(workers, len(files)))
+        glog.info('Ingesting {} case surveillance files with {} workers'.format(len(files), workers))
+        if workers == 1:
+            for file in files:
+                ingested(file, *measure_case_surv_file(path, file, chunksize))
+        else:
+            # map yields in submission order, the cube sees the days in date order. Workers
+            # are spawned, forking the threads of a serving process (refresh, downloads) can deadlock
+            context = multiprocessing.get_context('spawn')
+            with ProcessPoolExecutor(max_workers=workers, mp_context=context) as executor:
+                for file, result in zip(files, executor.map(measure_case_surv_file, [path] * len(files),
+                                                            files, [chunksize] * len(files))):
+                    ingested(file, *result)
+    if len(pendingdates) > 0:
+        with telemetry.stage('write', dataset='CaseSurveillanceData'):
+            case_cube.save(case_surv_cube_file)
+    ingest_manifest.save()
+
+    if load:
+        return case_surv_store.read()
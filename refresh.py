@@ -0,0 +1,202 @@
+"""Scheduled snapshot rebuilds and hot-swapping of the served snapshot
+
+Every process serving the dashboard holds one SnapshotRefresher. A watcher
+thread swaps in a new snapshot as soon as one is made current, and with a
+refresh interval set, the processes also take turns rebuilding snapshots
+in a subprocess, off the request path. When there is no snapshot at all,
+e.g. on a fresh tmpfs, the first one is built the same way while the
+server already answers.
+
+Run `python refresh.py` to rebuild on a schedule from a sidecar process
+instead.
+"""
+import fcntl
+import gc
+import os
+import subprocess
+import sys
+import threading
+import time
+
+import glog
+
+import snapshot
+
+REFRESH_INTERVAL = int(os.environ.get('REFRESH_INTERVAL', 0))
+POLL_INTERVAL = int(os.environ.get('REFRESH_POLL_INTERVAL', 30))
+LOCK_FILE = '.refresh.lock'
+STAMP_FILE = '.last_refresh'
+
+
+def build_due(root, interval):
+    """a snapshot build finished (or was attempted) more than interval seconds ago"""
+
+    stamps = [os.path.join(root, name) for name in (STAMP_FILE, snapshot.CURRENT_FILE)]
+    mtimes = [os.stat(stamp).st_mtime for stamp in stamps if os.path.exists(stamp)]
+    return len(mtimes) == 0 or time.time() - max(mtimes) >= interval
+
+
+def run_build(root=snapshot.SNAPSHOT_ROOT, interval=REFRESH_INTERVAL, args=(), missing_only=False):
+    """rebuild the snapshot in a subprocess if due and no other process is on it
+
+    Returns True when a build ran. The lock and the stamp file live in the
+    snapshot root, so any number of processes can call this on a timer.
+    With missing_only, it only builds while there is no current snapshot.
+    """
+
+    if not os.path.exists(root):
+        os.makedirs(root)
+    with open(os.path.join(root, LOCK_FILE), 'w') as lock:
+        try:
+            fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except (IOError, OSError):
+            return False
+        try:
+            if missing_only and snapshot.current_version(root) is not None:
+                return False
+            if not build_due(root, interval):
+                return False
+            glog.info('Refreshing snapshot in {}'.format(root))
+            script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot.py')
+            env = dict(os.environ, SNAPSHOT_DIR=root)
+            returncode = subprocess.call([sys.executable, script] + list(args), env=env)
+            if returncode != 0:
+                glog.error('Snapshot refresh failed with exit code {}'.format(returncode))
+            # failed builds are retried at the next interval, not in a tight loop
+            with open(os.path.join(root, STAMP_FILE), 'w') as f:
+                f.write(str(returncode))
+            return returncode == 0
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+class SnapshotRefresher(object):
+    """Serves one snapshot at a time and swaps it atomically
+
+    Callers take current() once per request and use that object throughout,
+    a swap replaces the reference and never mutates a snapshot in use, so an
+    in-flight callback never sees a half-updated state. Listeners are told
+    about the new snapshot after the swap.
+    """
+
+    def __init__(self, root=snapshot.SNAPSHOT_ROOT, interval=REFRESH_INTERVAL,
+                 poll_interval=POLL_INTERVAL, listeners=None):
+        self.root = root
+        self.interval = interval
+        self.poll_interval = poll_interval
+        self.listeners = list(listeners or [])
+        self._snapshot = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+
+    def current(self):
+        return self._snapshot
+
+    @property
+    def version(self):
+        return self._snapshot.version if self._snapshot is not None else None
+
+    def load(self, preload=False):
+        """open the current snapshot, None while there is none yet
+
+        The missing snapshot is built by the threads of ensure_started().
+        """
+
+        version = snapshot.current_version(self.root)
+        if version is None:
+            glog.warning('No snapshot in {} yet, building one in the background'.format(self.root))
+            return None
+        new = snapshot.Snapshot(os.path.join(self.root, version))
+        if preload:
+            new.preload()
+        self._swap(new)
+        return new
+
+    def release(self):
+        """stop serving the snapshot and drop its memory maps, e.g. in a forking master"""
+
+        with self._lock:
+            self._snapshot = None
+        # the maps close once the tables built on them are collected
+        gc.collect()
+
+    def _swap(self, new):
+        self._snapshot = new
+        for listener in self.listeners:
+            listener(new)
+        glog.info('Serving snapshot {}'.format(new.version))
+
+    def check(self):
+        """swap in the current snapshot if it changed, return True on a swap"""
+
+        version = snapshot.current_version(self.root)
+        if version is None or version == self.version:
+            return False
+        with self._lock:
+            if version == self.version:
+                return False
+            # load everything before the swap so requests never wait on disk
+            self._swap(snapshot.Snapshot(os.path.join(self.root, version)).preload())
+        return True
+
+    def ensure_started(self):
+        """start the background threads of this process, once per fork"""
+
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            # only opened here, the watcher loads it without holding up the caller
+            if self._snapshot is None:
+                self.load()
+            self._start_thread(self._watch_loop, 'snapshot-watcher')
+            if self.interval > 0 or self._snapshot is None:
+                self._start_thread(self._build_loop, 'snapshot-builder')
+
+    def _start_thread(self, target, name):
+        thread = threading.Thread(target=target, name=name)
+        thread.daemon = True
+        thread.start()
+
+    def _watch_loop(self):
+        snap = self._snapshot
+        if snap is not None:
+            try:
+                snap.preload()
+            except Exception as exc:
+                glog.error('Snapshot preload failed: {}'.format(exc))
+        while not self._stop.wait(self.poll_interval):
+            try:
+                self.check()
+            except Exception as exc:
+                glog.error('Snapshot swap failed: {}'.format(exc))
+
+    def _build_loop(self):
+        # without a snapshot the first build starts right away
+        wait = 0 if self._snapshot is None else self.poll_interval
+        while not self._stop.wait(wait):
+            wait = self.poll_interval
+            try:
+                if self._snapshot is None:
+                    built = run_build(self.root, 0, missing_only=True)
+                elif self.interval > 0:
+                    built = run_build(self.root, self.interval)
+                else:
+                    return
+                if built:
+                    self.check()
+            except Exception as exc:
+                glog.error('Snapshot refresh failed: {}'.format(exc))
+
+    def stop(self):
+        self._stop.set()
+
+
+if __name__ == '__main__':
+    interval = REFRESH_INTERVAL or 6 * 3600
+    while True:
+        run_build(snapshot.SNAPSHOT_ROOT, interval)
+        time.sleep(POLL_INTERVAL)
@@ -0,0 +1,45 @@
+import glog
+import numpy as np
+import pandas as pd
+
+STATE_CATEGORIES = ['state', 'State or Region Code', 'Risk Level']
+STATE_DATES = ['Date', 'submission_date']
+
+
+def memory_usage_mb(df):
+    return df.memory_usage(deep=True).sum() / 1024.0 ** 2
+
+
+def report_memory(name, before, after):
+    """log the memory use of a table before and after compaction"""
+
+    before_mb, after_mb = memory_usage_mb(before), memory_usage_mb(after)
+    glog.info('{}: {:.1f} MB -> {:.1f} MB ({:.1f}x smaller)'.format(
+        name, before_mb, after_mb, before_mb / after_mb if after_mb > 0 else 0))
+
+
+def downcast_floats(df, cols=None):
+    """float64 columns to float32 wherever every value survives the round trip"""
+
+    cols = cols if cols is not None else df.select_dtypes(include=['float64']).columns
+    for col in cols:
+        values = df[col].values
+        small = values.astype(np.float32)
+        if np.array_equal(small.astype(np.float64), values, equal_nan=True):
+            df[col] = small
+    return df
+
+
+def compact_state_data(usDataDf, name='usDataDf'):
+    """categorical labels, datetime dates and lossless float32 metrics of the state table"""
+
+    out = usDataDf.copy()
+    for col in STATE_DATES:
+        if col in out.columns:
+            out[col] = pd.to_datetime(out[col])
+    for col in STATE_CATEGORIES:
+        if col in out.columns:
+            out[col] = out[col].astype('category')
+    out = downcast_floats(out)
+    report_memory(name, usDataDf, out)
+    return out
@@ -0,0 +1,348 @@
+"""Build and load the ready-to-serve data snapshot of the dashboard
+
+Run `python snapshot.py` to download, consolidate and write a snapshot,
+app.py only loads the latest one. `--no-download` only consolidates the
+files already on disk.
+"""
+import datetime
+import hashlib
+import json
+import os
+import shutil
+import sys
+import threading
+
+import glog
+import pandas as pd
+import plotly
+import plotly.express as px
+import pyarrow as pa
+import pyarrow.feather as feather
+
+import animation
+import cube
+import indexes
+import metrics
+import processData
+import schema
+import telemetry
+
+SNAPSHOT_ROOT = os.environ.get('SNAPSHOT_DIR', './ProdData/snapshot')
+CURRENT_FILE = 'CURRENT'
+META_FILE = 'meta.json'
+# snapshots kept on disk, older ones are removed after a build
+KEEP_SNAPSHOTS = 2
+
+# options of the risk map and the column each one colors the states by
+RISK_VIEWS = {'Adjusted Case Rate': 'Adjusted Case Rate', 'CA Risk Level Threshold': 'Risk Level'}
+
+# per state series served by the charts and the data api
+STATE_SERIES_COLS = ['tot_cases', 'new_case', 'tot_death', 'new_death', 'death rate',
+                     'case fatality rate', 'Total Cases per Population', 'New Cases per Population',
+                     '7 day average new cases', 'Adjusted Case Rate', 'Risk Level']
+
+
+def download_data(date=None):
+    """fetch every missing daily file of both CDC datasets"""
+
+    prev_day = date or datetime.datetime.today() - datetime.timedelta(1)
+    processData.check_download(
+        prev_day,
+        processData.usStateDataLink,
+        processData.us_state_data_query,
+        'US-State-Data',
+        'StateData')
+    processData.check_download(
+        prev_day,
+        processData.caseSurveillanceData,
+        processData.case_surveillance_query,
+        'Case-Surveillance',
+        'CaseSurveillanceData')
+
+
+def risk_figure(data, view):
+    """state map of the adjusted case rate or of its CA risk tier"""
+
+    col = RISK_VIEWS[view]
+    figure = px.choropleth(data,
+                        scope='usa',
+                        locations="state",
+                        locationmode='USA-states',
+                        color=data[col],
+                        hover_name="state",
+                        featureidkey='properties.state',
+                        hover_data=['Adjusted Case Rate'],
+                        color_continuous_scale='Reds',
+                        labels={
+                            'Risk Level': 'Risk level based on Adjusted Case Rate'},
+                        title='State Risk Level'
+                        )
+
+    figure.update_layout(
+        showlegend=True,
+        legend_title_text='<b>Risk Level</b>',
+        font={"size": 16, "color": "#808080", "family": "calibri"},
+        margin={"r": 0, "t": 40, "l": 0, "b": 0},
+        legend=dict(orientation='v'),
+        geo=dict(bgcolor='rgba(0,0,0,0)', lakecolor='#e0fffe')
+    )
+
+    return figure
+
+
+def case_surv_figure(case_cube, dimension):
+    """share of case surveillance rows per category of dimension"""
+
+    datadf = case_cube.breakdown(dimension)
+    datadf['% Count'] = (100.0*datadf['share']).round(2).astype(str) + '%'
+    return px.bar(datadf, x=dimension, y='% Count', color=dimension)
+
+
+def build_serving_data(usDataDf, case_cube):
+    """derived tables, figures and summary values shown by the dashboard"""
+
+    maxdt = '{:%Y-%m-%d}'.format(case_cube.max_date())
+
+    max_state_dt = usDataDf['Date'].max()
+    data_str = '{}-{}-{:02d}'.format(max_state_dt.year, max_state_dt.month, max_state_dt.day)
+
+    usDataDf2 = usDataDf[~usDataDf.state.isin(['US'])]
+
+    # DataFrame for top new covid cases
+    topCases = usDataDf2[usDataDf2['Date'] == data_str][
+        ['Date','state','tot_cases','tot_death']].sort_values('tot_cases', ascending=False)
+    topCases['Date'] = topCases['Date'].dt.strftime('%Y-%m-%d')
+    for col in ['tot_cases','tot_death']:
+        topCases[col] = metrics.format_thousands(topCases[col])
+
+    USTotalCases = usDataDf2[usDataDf2['submission_date']==data_str]['tot_cases'].astype(float).sum()
+    statesNames = sorted(usDataDf['state'].astype(str).unique().tolist())
+    usDataDf['new_case'] = usDataDf['new_case'].astype(float)
+
+    USTopNewCases = usDataDf2[usDataDf2['submission_date'] == data_str][['state', 'new_case',
+    '7 day average new cases','new_death']].sort_values(
+        by='new_case', ascending=False)
+
+    us_bar = px.bar(USTopNewCases.sort_values(by='new_case',ascending=True),
+        y = 'state', x = 'new_case', text='new_case', orientation='h', color='new_case',
+         color_continuous_scale=["orange", "red"], height=1000)
+    us_bar.update_traces(texttemplate='%{text:.2s}', textposition='outside')
+    us_bar.update_layout(uniformtext_minsize=6, uniformtext_mode='hide',
+                         xaxis={'categoryorder':'total descending'})
+
+    for col in ['new_case', '7 day average new cases']:
+        USTopNewCases[col] = metrics.format_thousands(USTopNewCases[col])
+
+    # data for death rate
+    death_rate_rank = usDataDf[usDataDf['Date'] == data_str].sort_values(
+        'death rate', ascending=False, na_position='last')[['state', 'death rate']]
+    death_rate_rank['death rate'] = metrics.format_percent(death_rate_rank['death rate'])
+
+    # only the per day data of the cases map is stored, frames are drawn on demand
+    glog.info('Build animation frames')
+    case_frames = animation.build_case_frames(usDataDf2)
+
+    #Data for adjusted case rate
+    data = usDataDf2[usDataDf2['Date'] == data_str]
+    risk_maps = {col: risk_figure(data, col) for col in RISK_VIEWS}
+
+    # every breakdown is small, the page switches between them without the server
+    case_surv_charts = {dim: case_surv_figure(case_cube, dim) for dim in cube.CASE_SURV_DIMENSIONS}
+
+    tables = {
+        # in state series index order, so the index uses the mapped columns as they are
+        'usDataDf': usDataDf.iloc[indexes.index_order(usDataDf)],
+        'topCases': topCases,
+        'USTopNewCases': USTopNewCases,
+        'death_rate_rank': death_rate_rank,
+        'case_cube': case_cube.table,
+        'case_frames': case_frames,
+    }
+    figures = {'us_bar': us_bar, 'risk_maps': risk_maps, 'case_surv_charts': case_surv_charts}
+    meta = {
+        'data_str': data_str,
+        'maxdt': maxdt,
+        'USTotalCases': float(USTotalCases),
+        'statesNames': statesNames,
+    }
+    return tables, figures, meta
+
+
+def _write_table(df, filename):
+    """uncompressed arrow ipc file, mapped in place by every worker
+
+    Float columns keep NaN as a value instead of a null, a column without
+    nulls is read without a copy.
+    """
+
+    df = df.reset_index(drop=True)
+    table = pa.Table.from_pandas(df, preserve_index=False)
+    for i, name in enumerate(table.column_names):
+        if pd.api.types.is_float_dtype(df[name]):
+            table = table.set_column(i, table.schema.field(i), pa.array(df[name].values, from_pandas=False))
+    feather.write_feather(table, filename, compression='uncompressed')
+
+
+def current_version(root=SNAPSHOT_ROOT):
+    filename = os.path.join(root, CURRENT_FILE)
+    if not os.path.exists(filename):
+        return None
+    with open(filename) as f:
+        return f.read().strip()
+
+
+def _set_current(root, version):
+    tmp_filename = os.path.join(root, '{}.{}.tmp'.format(CURRENT_FILE, os.getpid()))
+    with open(tmp_filename, 'w') as f:
+        f.write(version)
+    os.replace(tmp_filename, os.path.join(root, CURRENT_FILE))
+
+
+def _prune(root, keep=KEEP_SNAPSHOTS):
+    current = current_version(root)
+    versions = sorted((d for d in os.listdir(root)
+                       if not d.startswith('.') and os.path.isdir(os.path.join(root, d))),
+                      key=lambda d: os.stat(os.path.join(root, d)).st_mtime)
+    for version in versions[:-keep]:
+        if version != current:
+            shutil.rmtree(os.path.join(root, version), ignore_errors=True)
+
+
+def write_snapshot(tables, figures, meta, root=SNAPSHOT_ROOT):
+    """write a snapshot next to the current one, then make it current"""
+
+    if not os.path.exists(root):
+        os.makedirs(root)
+    build_dir = os.path.join(root, '.build-{}'.format(os.getpid()))
+    shutil.rmtree(build_dir, ignore_errors=True)
+    os.makedirs(build_dir)
+
+    digest = hashlib.sha1()
+    for name in sorted(tables):
+        filename = os.path.join(build_dir, '{}.arrow'.format(name))
+        _write_table(tables[name], filename)
+        with open(filename, 'rb') as f:
+            digest.update(f.read())
+    for name, figure in figures.items():
+        # a figure or a dict of figures switched between by the page
+        with open(os.path.join(build_dir, '{}.json'.format(name)), 'w') as f:
+            json.dump(figure, f, cls=plotly.utils.PlotlyJSONEncoder)
+
+    # the version only changes when the served data does
+    version = '{}-{}'.format(pd.Timestamp(meta['data_str']).strftime('%Y%m%d'), digest.hexdigest()[:12])
+    meta = dict(meta, version=version,
+                built_at=datetime.datetime.utcnow().strftime('%Y-%m-%dT%H:%M:%S'),
+                tables=sorted(tables), figures=sorted(figures))
+    with open(os.path.join(build_dir, META_FILE), 'w') as f:
+        json.dump(meta, f)
+
+    if os.path.exists(os.path.join(root, version)):
+        shutil.rmtree(build_dir)
+    else:
+        os.replace(build_dir, os.path.join(root, version))
+    _set_current(root, version)
+    _prune(root)
+    glog.info('Snapshot {} written to {}'.format(version, root))
+    return version
+
+
+def build_snapshot(root=SNAPSHOT_ROOT, download=True):
+    """run the whole data pipeline and write a new current snapshot"""
+
+    if download:
+        download_data()
+    processData.consolidate_case_surv_data()
+    case_cube = processData.load_case_surv_cube()
+    processData.consolidate_state_data()
+    usDataDf = schema.compact_state_data(processData.state_store.read())
+    with telemetry.stage('serving_data'):
+        tables, figures, meta = build_serving_data(usDataDf, case_cube)
+    # the stages of this build, reported by the dashboard serving it
+    meta = dict(meta, pipeline=telemetry.pipeline_summary())
+    return write_snapshot(tables, figures, meta, root)
+
+
+class Snapshot(object):
+    """Read-only view of one snapshot directory
+
+    Summary values are read on open, tables and figures are loaded on first
+    access and kept for the life of the snapshot. Tables are memory mapped,
+    with the snapshot root on a tmpfs such as /dev/shm every worker of the
+    host shares one copy of them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        self.version = self.meta['version']
+        self._arrow = {}
+        self._tables = {}
+        self._figures = {}
+        self._state_series = None
+        self._case_cube = None
+        self._case_frames = None
+        self._lock = threading.RLock()
+
+    def arrow(self, name):
+        """arrow table memory mapped from the snapshot file, nothing is copied"""
+
+        with self._lock:
+            if name not in self._arrow:
+                self._arrow[name] = feather.read_table(os.path.join(self.path, '{}.arrow'.format(name)),
+                                                       memory_map=True)
+            return self._arrow[name]
+
+    def table(self, name):
+        """table as a DataFrame, numeric, date and category code columns are views of the mapping"""
+
+        with self._lock:
+            if name not in self._tables:
+                self._tables[name] = self.arrow(name).to_pandas(split_blocks=True)
+            return self._tables[name]
+
+    def figure(self, name):
+        """figure (or dict of figures) as plotly json dicts"""
+
+        with self._lock:
+            if name not in self._figures:
+                with open(os.path.join(self.path, '{}.json'.format(name))) as f:
+                    self._figures[name] = json.load(f)
+            return self._figures[name]
+
+    @property
+    def state_series(self):
+        with self._lock:
+            if self._state_series is None:
+                self._state_series = indexes.StateSeriesIndex(self.table('usDataDf'), STATE_SERIES_COLS)
+            return self._state_series
+
+    @property
+    def case_cube(self):
+        with self._lock:
+            if self._case_cube is None:
+                self._case_cube = cube.CaseSurvCube(self.table('case_cube'))
+            return self._case_cube
+
+    @property
+    def case_frames(self):
+        with self._lock:
+            if self._case_frames is None:
+                self._case_frames = animation.CaseFrames(self.arrow('case_frames'))
+            return self._case_frames
+
+    def preload(self):
+        """load everything now, e.g. on a worker thread before the first request"""
+
+        for name in self.meta['tables']:
+            self.table(name)
+        for name in self.meta['figures']:
+            self.figure(name)
+        self.state_series
+        self.case_cube
+        self.case_frames
+        return self
+
+
+if __name__ == '__main__':
+    build_snapshot(download='--no-download' not in sys.argv[1:])
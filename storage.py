@@ -0,0 +1,191 @@
+import os
+import shutil
+
+import glog
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+
+STATE_SCHEMA = pa.schema([
+    ('Date', pa.timestamp('ms')),
+    ('state', pa.string()),
+    ('tot_cases', pa.float64()),
+    ('new_case', pa.float64()),
+    ('tot_death', pa.float64()),
+    ('new_death', pa.float64()),
+    ('submission_date', pa.string()),
+    ('case fatality rate', pa.float64()),
+    ('State or Region Code', pa.string()),
+    ('Population', pa.float64()),
+    ('death rate', pa.float64()),
+    ('Total Cases per Population', pa.float64()),
+    ('New Cases per Population', pa.float64()),
+    ('7 day average new cases', pa.float64()),
+    ('Adjusted Case Rate', pa.float64()),
+    ('Risk Level', pa.string()),
+])
+
+CASE_SURV_SCHEMA = pa.schema([
+    ('Date', pa.timestamp('ms')),
+    ('cdc_report_dt', pa.string()),
+    ('onset_dt', pa.string()),
+    ('current_status', pa.string()),
+    ('sex', pa.string()),
+    ('age_group', pa.string()),
+    ('race_ethnicity_combined', pa.string()),
+    ('hosp_yn', pa.string()),
+    ('icu_yn', pa.string()),
+    ('death_yn', pa.string()),
+    ('medcond_yn', pa.string()),
+])
+
+PARTITION_PREFIX = 'date='
+PARTITION_FILE = 'part-0.parquet'
+
+
+class PartitionedStore(object):
+    """Typed parquet table partitioned by day
+
+    Every day lives in its own <root>/date=YYYY-MM-DD/part-0.parquet file so
+    new days are written without touching existing ones, and reads only
+    open the partitions inside the requested date range.
+    """
+
+    def __init__(self, root, schema, date_col='Date'):
+        self.root = root
+        self.schema = schema
+        self.date_col = date_col
+
+    def _partition_dir(self, date):
+        return os.path.join(self.root, '{}{}'.format(PARTITION_PREFIX, date))
+
+    def dates(self):
+        """sorted YYYY-MM-DD strings of the stored partitions"""
+
+        if not os.path.isdir(self.root):
+            return []
+        return sorted(d[len(PARTITION_PREFIX):] for d in os.listdir(self.root)
+                      if d.startswith(PARTITION_PREFIX)
+                      and os.path.exists(os.path.join(self.root, d, PARTITION_FILE)))
+
+    def empty(self):
+        return len(self.dates()) == 0
+
+    def _to_table(self, df):
+        df = df.copy()
+        for field in self.schema:
+            if field.name not in df.columns:
+                df[field.name] = None
+            elif pa.types.is_string(field.type):
+                col = df[field.name]
+                df[field.name] = col.astype(str).where(col.notnull(), None)
+        return pa.Table.from_pandas(df[self.schema.names], schema=self.schema, preserve_index=False)
+
+    def _open_writer(self, date):
+        partition = self._partition_dir(date)
+        if not os.path.exists(partition):
+            os.makedirs(partition)
+        return pq.ParquetWriter(os.path.join(partition, PARTITION_FILE + '.tmp'), self.schema)
+
+    def _close_writer(self, date, writer, commit=True):
+        writer.close()
+        filename = os.path.join(self._partition_dir(date), PARTITION_FILE)
+        if commit:
+            os.replace(filename + '.tmp', filename)
+        else:
+            os.remove(filename + '.tmp')
+
+    def write_chunks(self, date, chunks):
+        """stream an iterable of frames into the partition of one day
+
+        Each frame becomes a row group, only one chunk is held in memory at a
+        time and the partition replaces the previous one once complete.
+        """
+
+        writer = self._open_writer(date)
+        try:
+            for chunk in chunks:
+                writer.write_table(self._to_table(chunk))
+        except Exception:
+            self._close_writer(date, writer, commit=False)
+            raise
+        self._close_writer(date, writer)
+
+    def write_partition(self, date, df):
+        """write (or replace) the partition of one day"""
+
+        self.write_chunks(date, [df])
+
+    def write(self, df):
+        """write one partition per distinct day of df"""
+
+        days = pd.to_datetime(df[self.date_col]).dt.strftime('%Y-%m-%d')
+        for date, part in df.groupby(days.values, sort=True):
+            self.write_partition(date, part)
+
+    def remove(self, date):
+        """drop the partition of one day"""
+
+        shutil.rmtree(self._partition_dir(date), ignore_errors=True)
+
+    def clear(self):
+        if os.path.isdir(self.root):
+            shutil.rmtree(self.root)
+
+    def read(self, start=None, end=None, states=None, columns=None, state_col='state'):
+        """read days between start and end (inclusive YYYY-MM-DD strings)
+
+        Partitions outside the range are never opened, the optional state
+        filter is pushed down to the parquet reader.
+        """
+
+        dates = [d for d in self.dates()
+                 if (start is None or d >= str(start)[:10]) and (end is None or d <= str(end)[:10])]
+        files = [os.path.join(self._partition_dir(d), PARTITION_FILE) for d in dates]
+        if len(files) == 0:
+            return self.schema.empty_table().to_pandas()
+        dataset = ds.dataset(files, schema=self.schema, format='parquet')
+        row_filter = None
+        if states is not None:
+            row_filter = ds.field(state_col).isin(list(states))
+        return dataset.to_table(columns=columns, filter=row_filter).to_pandas()
+
+    def migrate_csv(self, csv_file, chunksize=None):
+        """one-time import of a consolidated csv written by the previous versions
+
+        The csv is not guaranteed to be sorted by day, so every chunk's rows
+        of a day are first staged as their own small file. Each partition is
+        then written from its staged files, one file open at a time.
+        """
+
+        if not self.empty() or not os.path.exists(csv_file) or os.stat(csv_file).st_size <= 4:
+            return False
+        glog.info('Migrating {} to {}'.format(csv_file, self.root))
+        dtype = {f.name: str for f in self.schema if pa.types.is_string(f.type)}
+        chunks = pd.read_csv(csv_file, dtype=dtype, chunksize=chunksize)
+        staging = os.path.join(self.root, '.migrate')
+        shutil.rmtree(staging, ignore_errors=True)
+        try:
+            staged = {}
+            for i, chunk in enumerate([chunks] if chunksize is None else chunks):
+                chunk[self.date_col] = pd.to_datetime(chunk[self.date_col])
+                days = chunk[self.date_col].dt.strftime('%Y-%m-%d')
+                for date, part in chunk.groupby(days.values, sort=True):
+                    filename = os.path.join(staging, date, '{}.parquet'.format(i))
+                    os.makedirs(os.path.dirname(filename), exist_ok=True)
+                    pq.write_table(self._to_table(part), filename)
+                    staged.setdefault(date, []).append(filename)
+            written = []
+            try:
+                for date in sorted(staged):
+                    self.write_chunks(date, (pq.read_table(f).to_pandas() for f in staged[date]))
+                    written.append(date)
+            except Exception:
+                # a partial import would stop the next run from migrating again
+                for date in written:
+                    self.remove(date)
+                raise
+        finally:
+            shutil.rmtree(staging, ignore_errors=True)
+        return True
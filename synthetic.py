@@ -0,0 +1,201 @@
+"""Synthetic CDC data at any scale and a local fake Socrata server serving it
+
+The generated files have the columns of the CDC datasets without the index
+column, the way Socrata returns them. FakeSocrata answers the paged
+queries of downloader.Downloader for them, point a downloader at it with
+socrata_client_factory('127.0.0.1:<port>', 'http://').
+"""
+import csv
+import os
+import re
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import parse_qs, urlparse
+
+import numpy as np
+import pandas as pd
+
+# first day check_download asks for
+START_DATE = '2020-01-24'
+
+STATE_FILE_COLS = ['submission_date', 'state', 'tot_cases', 'conf_cases', 'prob_cases', 'new_case',
+                   'pnew_case', 'tot_death', 'conf_death', 'prob_death', 'new_death', 'pnew_death',
+                   'created_at', 'consent_cases', 'consent_deaths']
+CASE_SURV_FILE_COLS = ['cdc_report_dt', 'pos_spec_dt', 'onset_dt', 'current_status', 'sex', 'age_group',
+                       'race_ethnicity_combined', 'hosp_yn', 'icu_yn', 'death_yn', 'medcond_yn']
+CASE_SURV_VALUES = {
+    'current_status': ['Laboratory-confirmed case', 'Probable Case'],
+    'sex': ['Female', 'Male', 'Unknown', 'Missing', 'Other'],
+    'age_group': ['0 - 9 Years', '10 - 19 Years', '20 - 29 Years', '30 - 39 Years', '40 - 49 Years',
+                  '50 - 59 Years', '60 - 69 Years', '70 - 79 Years', '80+ Years', 'Unknown'],
+    'race_ethnicity_combined': ['White, Non-Hispanic', 'Hispanic/Latino', 'Black, Non-Hispanic',
+                                'Asian, Non-Hispanic', 'Multiple/Other, Non-Hispanic',
+                                'American Indian/Alaska Native, Non-Hispanic',
+                                'Native Hawaiian/Other Pacific Islander, Non-Hispanic', 'Unknown'],
+    'hosp_yn': ['Yes', 'No', 'Unknown', 'Missing'],
+    'icu_yn': ['Yes', 'No', 'Unknown', 'Missing'],
+    'death_yn': ['Yes', 'No', 'Unknown', 'Missing'],
+    'medcond_yn': ['Yes', 'No', 'Unknown', 'Missing'],
+}
+SOCRATA_DATE = '%Y-%m-%dT00:00:00.000'
+
+
+def date_range(days, start=START_DATE):
+    return pd.date_range(start, periods=days)
+
+
+def write_state_data(folder, states, days, start=START_DATE, seed=0):
+    """one US-State-Data-<date>.csv per day, cumulative counts growing per state"""
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    rng = np.random.RandomState(seed)
+    dates = date_range(days, start)
+    # daily new cases and deaths of every state, a noisy wave
+    wave = 1 + np.sin(np.linspace(0, 3 * np.pi, days))[:, None]
+    scale = rng.uniform(10, 5000, size=len(states))[None, :]
+    new_case = rng.poisson(wave * scale)
+    new_death = rng.binomial(new_case, 0.015)
+    tot_cases, tot_death = new_case.cumsum(axis=0), new_death.cumsum(axis=0)
+    for i, dt in enumerate(dates):
+        df = pd.DataFrame({
+            'submission_date': dt.strftime(SOCRATA_DATE),
+            'state': states,
+            'tot_cases': tot_cases[i],
+            'conf_cases': '',
+            'prob_cases': '',
+            'new_case': new_case[i],
+            'pnew_case': 0,
+            'tot_death': tot_death[i],
+            'conf_death': '',
+            'prob_death': '',
+            'new_death': new_death[i],
+            'pnew_death': 0,
+            'created_at': (dt + pd.Timedelta(days=1)).strftime(SOCRATA_DATE),
+            'consent_cases': 'Agree',
+            'consent_deaths': 'Agree',
+        })
+        df[STATE_FILE_COLS].to_csv(os.path.join(folder, 'US-State-Data-{:%Y-%m-%d}.csv'.format(dt)), index=False)
+    return len(dates) * len(states)
+
+
+def write_case_surv_data(folder, rows, days, start=START_DATE, seed=0, chunksize=1000000):
+    """one Case-Surveillance-<date>.csv per day, rows spread over the days
+
+    Each day is generated and written chunksize rows at a time, tens of
+    millions of rows never sit in memory at once.
+    """
+
+    if not os.path.exists(folder):
+        os.makedirs(folder)
+    rng = np.random.RandomState(seed)
+    dates = date_range(days, start)
+    per_day = rng.multinomial(rows, np.ones(days) / days)
+    for dt, n in zip(dates, per_day):
+        filename = os.path.join(folder, 'Case-Surveillance-{:%Y-%m-%d}.csv'.format(dt))
+        header = True
+        with open(filename, 'w', newline='') as f:
+            for size in [chunksize] * (n // chunksize) + [n % chunksize]:
+                if size == 0 and not header:
+                    continue
+                lag = pd.to_timedelta(rng.randint(0, 21, size=size), unit='D')
+                spec_dt = pd.Series((dt - lag).strftime(SOCRATA_DATE))
+                df = pd.DataFrame({'cdc_report_dt': dt.strftime(SOCRATA_DATE),
+                                   'pos_spec_dt': spec_dt,
+                                   'onset_dt': spec_dt.where(rng.rand(size) < 0.6, '')})
+                for col, values in CASE_SURV_VALUES.items():
+                    df[col] = np.asarray(values, dtype=object)[rng.randint(0, len(values), size=size)]
+                df[CASE_SURV_FILE_COLS].to_csv(f, index=False, header=header)
+                header = False
+    return int(per_day.sum())
+
+
+class _Server(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class FakeSocrata(object):
+    """Local http server answering SoQL day queries from generated files
+
+    datasets maps a dataset id to (folder, file prefix). Only the queries
+    the downloader sends are understood:
+    SELECT * WHERE <col>='<date>' ORDER BY :id LIMIT <n> OFFSET <m>
+    """
+
+    QUERY = re.compile(r"WHERE \w+='(\d{4}-\d{2}-\d{2})'.*LIMIT (\d+) OFFSET (\d+)")
+
+    def __init__(self, datasets, host='127.0.0.1', port=0):
+        self.datasets = datasets
+        self.requests = 0
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                fake.requests += 1
+                status, body = fake.respond(self.path)
+                self.send_response(status)
+                self.send_header('Content-Type', 'text/csv; charset=utf-8')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = _Server((host, port), Handler)
+        self.host, self.port = self.server.server_address[:2]
+        self._thread = None
+
+    @property
+    def domain(self):
+        return '{}:{}'.format(self.host, self.port)
+
+    def respond(self, path):
+        url = urlparse(path)
+        match = re.match(r'/resource/([\w-]+)\.csv$', url.path)
+        if match is None or match.group(1) not in self.datasets:
+            return 404, b''
+        query = self.QUERY.search(parse_qs(url.query).get('$query', [''])[0])
+        if query is None:
+            return 400, b''
+        date, limit, offset = query.group(1), int(query.group(2)), int(query.group(3))
+        folder, prefix = self.datasets[match.group(1)]
+        filename = os.path.join(folder, '{}-{}.csv'.format(prefix, date))
+        if not os.path.exists(filename):
+            return 200, b''
+        with open(filename, newline='') as f:
+            reader = csv.reader(f)
+            rows = [next(reader)]
+            for i, row in enumerate(reader):
+                if i >= offset + limit:
+                    break
+                if i >= offset:
+                    rows.append(row)
+        out = _Lines()
+        csv.writer(out).writerows(rows)
+        return 200, ''.join(out.lines).encode()
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-socrata')
+        self._thread.daemon = True
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
+
+
+class _Lines(object):
+    def __init__(self):
+        self.lines = []
+
+    def write(self, line):
+        self.lines.append(line)
@@ -0,0 +1,364 @@
+"""Timing, memory and row counts of the pipeline and the dashboard, in the Prometheus text format
+
+Pipeline stages are timed with stage(), e.g.
+
+    with telemetry.stage('parse', dataset='StateData'):
+        ...
+
+which records the wall time, the resident memory at the end of the stage
+and its growth. The snapshot build stores a summary of its stages in the
+snapshot meta, so the dashboard also reports the run that built the data
+it serves. instrument_dash() times every server side callback of a Dash
+app including the serialization of its response, instrument_server()
+times every request and can profile them with cProfile. render() returns
+everything for a /metrics endpoint.
+"""
+import contextlib
+import cProfile
+import functools
+import os
+import random
+import re
+import resource
+import threading
+import time
+
+import glog
+from flask import g, request
+
+# seconds, from a cached callback to a full rebuild of the consolidated data
+DEFAULT_BUCKETS = (.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30, 60, 300, 900)
+# bytes of a callback response
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 3e5, 1e6, 3e6, 1e7)
+
+_PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def rss_bytes():
+    """resident memory of this process"""
+
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, IndexError, ValueError):
+        # peak instead of current where /proc is missing, kilobytes on linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{{{}}}'.format(','.join('{}="{}"'.format(k, _escape(v)) for k, v in labels))
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value))
+
+
+def _key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+class _Metric(object):
+    kind = None
+
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def header(self):
+        return ['# HELP {} {}'.format(self.name, self.documentation),
+                '# TYPE {} {}'.format(self.name, self.kind)]
+
+    def lines(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        return self.header() + ['{}{} {}'.format(self.name, _format_labels(labels), _format_value(value))
+                                for labels, value in values]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, value=1, **labels):
+        key = _key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+
+class Gauge(_Metric):
+    kind = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[_key(labels)] = value
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation)
+        self.buckets = tuple(buckets) + (float('inf'),)
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        with self._lock:
+            counts, total = self._values.get(key, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value)
+
+    def lines(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total)) for labels, (counts, total) in self._values.items())
+        lines = self.header()
+        for labels, (counts, total) in values:
+            for bound, count in zip(self.buckets, counts):
+                lines.append('{}_bucket{} {}'.format(
+                    self.name, _format_labels(labels + (('le', _format_value(bound)),)), count))
+            lines.append('{}_sum{} {}'.format(self.name, _format_labels(labels), _format_value(total)))
+            lines.append('{}_count{} {}'.format(self.name, _format_labels(labels), counts[-1]))
+        return lines
+
+
+class Registry(object):
+    """metrics of this process plus collectors called at every scrape
+
+    A collector returns a list of metrics filled with the values of the
+    moment, e.g. from the figure cache or the served snapshot.
+    """
+
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def counter(self, name, documentation):
+        return self.register(Counter(name, documentation))
+
+    def gauge(self, name, documentation):
+        return self.register(Gauge(name, documentation))
+
+    def histogram(self, name, documentation, buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        metrics = list(self._metrics)
+        for collector in self._collectors:
+            try:
+                metrics.extend(collector())
+            except Exception as exc:
+                glog.error('Metrics collector {} failed: {}'.format(collector, exc))
+        return '\n'.join(line for metric in metrics for line in metric.lines()) + '\n'
+
+
+REGISTRY = Registry()
+
+STAGE_SECONDS = REGISTRY.histogram('covid_pipeline_stage_seconds', 'Wall time of a data pipeline stage.')
+STAGE_RSS = REGISTRY.gauge('covid_pipeline_stage_rss_bytes', 'Resident memory at the end of the last run of a stage.')
+STAGE_RSS_GROWTH = REGISTRY.gauge('covid_pipeline_stage_rss_growth_bytes',
+                                  'Resident memory growth during the last run of a stage.')
+ROWS = REGISTRY.counter('covid_pipeline_rows_total', 'Rows handled by a data pipeline stage.')
+CALLBACK_SECONDS = REGISTRY.histogram('covid_callback_seconds',
+                                      'Latency of a Dash callback, phase compute or total with the response json.')
+CALLBACK_BYTES = REGISTRY.histogram('covid_callback_response_bytes', 'Size of a Dash callback response.',
+                                    SIZE_BUCKETS)
+REQUEST_SECONDS = REGISTRY.histogram('covid_http_request_seconds', 'Latency of an http request until its response.')
+
+# stages of this process, stored in the snapshot meta by the build
+_pipeline = {}
+_pipeline_lock = threading.Lock()
+
+
+def _label_name(labels):
+    return ' '.join('{}={}'.format(k, v) for k, v in sorted(labels.items()))
+
+
+def observe_stage(name, seconds, rss, rss_growth, **labels):
+    """record a stage timed elsewhere, e.g. in a worker process"""
+
+    STAGE_SECONDS.observe(seconds, stage=name, **labels)
+    STAGE_RSS.set(rss, stage=name, **labels)
+    STAGE_RSS_GROWTH.set(rss_growth, stage=name, **labels)
+    with _pipeline_lock:
+        entry = _pipeline.setdefault((name, _label_name(labels)),
+                                     {'stage': name, 'labels': labels, 'calls': 0, 'seconds': 0.0,
+                                      'rss_bytes': 0, 'rss_growth_bytes': 0, 'rows': 0})
+        entry['calls'] += 1
+        entry['seconds'] += seconds
+        entry['rss_bytes'] = max(entry['rss_bytes'], rss)
+        entry['rss_growth_bytes'] = max(entry['rss_growth_bytes'], rss_growth)
+
+
+@contextlib.contextmanager
+def stage(name, **labels):
+    """time a block of the pipeline"""
+
+    rss = rss_bytes()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        end_rss = rss_bytes()
+        observe_stage(name, time.perf_counter() - start, end_rss, end_rss - rss, **labels)
+
+
+def measure(func, *args, **kwargs):
+    """(result, seconds, rss, rss growth) of a call, for stages run in worker processes"""
+
+    rss = rss_bytes()
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    seconds = time.perf_counter() - start
+    end_rss = rss_bytes()
+    return result, seconds, end_rss, end_rss - rss
+
+
+def count_rows(name, rows, **labels):
+    ROWS.inc(rows, stage=name, **labels)
+    with _pipeline_lock:
+        entry = _pipeline.get((name, _label_name(labels)))
+        if entry is not None:
+            entry['rows'] += rows
+
+
+def pipeline_summary():
+    """the stages timed by this process, as stored in the snapshot meta"""
+
+    with _pipeline_lock:
+        return [dict(entry, labels=dict(entry['labels'])) for _, entry in sorted(_pipeline.items())]
+
+
+def _outcome(exc):
+    # PreventUpdate and friends are the callback deciding to send nothing
+    return 'prevented' if type(exc).__module__ == 'dash.exceptions' else 'error'
+
+
+def timed_callback(name):
+    """decorator timing the work of a Dash callback, before its response is serialized"""
+
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args):
+            start = time.perf_counter()
+            outcome = 'ok'
+            try:
+                return func(*args)
+            except Exception as exc:
+                outcome = _outcome(exc)
+                raise
+            finally:
+                CALLBACK_SECONDS.observe(time.perf_counter() - start, callback=name, phase='compute',
+                                         outcome=outcome)
+        return wrapper
+    return decorator
+
+
+def instrument_dash(app):
+    """time every server side callback registered on app so far
+
+    Dash serializes the response inside the registered function, so this
+    is the time of the callback and its json. Call it after the last
+    @app.callback.
+    """
+
+    for entry in app.callback_map.values():
+        func = entry.get('callback')
+        if func is None or getattr(func, '_instrumented', False):
+            continue
+        entry['callback'] = _instrument_callback(func)
+
+
+def _instrument_callback(func):
+    name = func.__name__
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        outcome = 'ok'
+        try:
+            response = func(*args, **kwargs)
+            if isinstance(response, str):
+                CALLBACK_BYTES.observe(len(response), callback=name)
+            return response
+        except Exception as exc:
+            outcome = _outcome(exc)
+            raise
+        finally:
+            CALLBACK_SECONDS.observe(time.perf_counter() - start, callback=name, phase='total', outcome=outcome)
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+class RequestProfiler(object):
+    """cProfile of sampled requests, one <profile_dir>/<time>-<pid>-<path>.prof per request
+
+    Read them with python -m pstats or snakeviz.
+    """
+
+    def __init__(self, profile_dir, sample=1.0):
+        self.profile_dir = profile_dir
+        self.sample = sample
+        if not os.path.exists(profile_dir):
+            os.makedirs(profile_dir, exist_ok=True)
+
+    def start(self):
+        if random.random() >= self.sample:
+            return None
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+
+    def stop(self, profiler, path):
+        profiler.disable()
+        name = re.sub(r'[^\w.-]+', '_', path.strip('/')) or 'index'
+        filename = os.path.join(self.profile_dir, '{:.6f}-{}-{}.prof'.format(time.time(), os.getpid(), name))
+        profiler.dump_stats(filename)
+
+
+def instrument_server(server, profile_dir=None, profile_sample=1.0, skip=('/metrics',)):
+    """time every request of a flask server, profiling them when profile_dir is set"""
+
+    profiler = RequestProfiler(profile_dir, profile_sample) if profile_dir else None
+    if profiler is not None:
+        glog.info('Profiling {:.0%} of requests to {}'.format(profile_sample, profile_dir))
+
+    @server.before_request
+    def start_request_timer():
+        g.request_start = time.perf_counter()
+        if profiler is not None and request.path not in skip:
+            g.request_profiler = profiler.start()
+
+    @server.after_request
+    def observe_request(response):
+        start = g.pop('request_start', None)
+        if start is not None and request.path not in skip:
+            # the rule keeps the label set small, unmatched urls share one label
+            endpoint = request.url_rule.rule if request.url_rule is not None else 'unmatched'
+            REQUEST_SECONDS.observe(time.perf_counter() - start, endpoint=endpoint,
+                                    method=request.method, status=response.status_code)
+        request_profiler = g.pop('request_profiler', None)
+        if request_profiler is not None:
+            profiler.stop(request_profiler, request.path)
+        return response
+
+
+def render():
+    return REGISTRY.render()
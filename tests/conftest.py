@@ -0,0 +1,23 @@
+import os
+import shutil
+import sys
+
+import pytest
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+# inputs of the pipeline that are not downloaded
+STATIC_FILES = ['StateCode.csv', os.path.join('data', 'pop.html')]
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """scratch directory with the static inputs, the pipeline reads and writes relative to it"""
+
+    for name in STATIC_FILES:
+        target = tmp_path / name
+        target.parent.mkdir(parents=True, exist_ok=True)
+        shutil.copy(os.path.join(REPO_DIR, name), str(target))
+    monkeypatch.chdir(tmp_path)
+    return tmp_path
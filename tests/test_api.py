@@ -0,0 +1,94 @@
+import gzip
+import json
+
+import brotli
+import numpy as np
+import pandas as pd
+import pytest
+from flask import Flask
+
+import api
+import cube
+import indexes
+
+STATES = ['AK', 'CA']
+DATES = pd.date_range('2020-11-01', periods=10)
+COLUMNS = ['new_case', 'new_death']
+
+
+class FakeSnapshot(object):
+    """the parts of snapshot.Snapshot the api reads, built in memory"""
+
+    version = 'test-version'
+    meta = {'built_at': '2020-11-11T00:00:00'}
+
+    def __init__(self):
+        rows = len(STATES) * len(DATES)
+        self.usDataDf = pd.DataFrame({'state': np.repeat(STATES, len(DATES)),
+                                      'Date': np.tile(DATES.values, len(STATES)),
+                                      'new_case': np.arange(rows, dtype=float),
+                                      'new_death': np.zeros(rows)})
+        self.state_series = indexes.StateSeriesIndex(self.usDataDf, COLUMNS)
+        days = pd.DataFrame({'sex': ['Female', 'Male', 'Male']})
+        self.case_cube = cube.CaseSurvCube(cube.merge_counts([cube.count_dimensions(days, date, ['sex'])
+                                                              for date in DATES]))
+
+    def table(self, name):
+        return self.usDataDf
+
+
+class FakeSnapshots(object):
+    def __init__(self, snap):
+        self.snap = snap
+
+    def current(self):
+        return self.snap
+
+
+@pytest.fixture
+def client():
+    server = Flask(__name__)
+    server.register_blueprint(api.create_api(FakeSnapshots(FakeSnapshot())))
+    return server.test_client()
+
+
+def test_empty_dates_are_no_bound(client):
+    response = client.get('/api/v1/states/CA?start=&end=')
+    assert response.status_code == 200
+    assert json.loads(response.data)['total'] == len(DATES)
+
+    response = client.get('/api/v1/surveillance/sex?start=')
+    assert response.status_code == 200
+    counts = {row['sex']: row['count'] for row in json.loads(response.data)['data']}
+    assert counts == {'Female': len(DATES), 'Male': 2 * len(DATES)}
+
+
+@pytest.mark.parametrize('url', ['/api/v1/states/CA?start=yesterday', '/api/v1/states/CA?end=NaT',
+                                 '/api/v1/metrics/new_case?start=2020-13-01',
+                                 '/api/v1/surveillance/sex?end=NaT'])
+def test_invalid_dates_are_rejected(client, url):
+    response = client.get(url)
+    assert response.status_code == 400
+    assert 'Invalid' in json.loads(response.data)['error']
+
+
+def test_dates_narrow_the_series(client):
+    response = client.get('/api/v1/states/CA?start=2020-11-03&end=2020-11-05')
+    data = json.loads(response.data)['data']
+    assert [row['Date'] for row in data] == ['2020-11-03', '2020-11-04', '2020-11-05']
+
+
+def test_not_modified_until_the_query_changes(client):
+    response = client.get('/api/v1/states/CA')
+    etag = response.headers['ETag']
+    assert client.get('/api/v1/states/CA', headers={'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/v1/states/AK', headers={'If-None-Match': etag}).status_code == 200
+
+
+@pytest.mark.parametrize('encoding, decompress', [('gzip', gzip.decompress), ('br', brotli.decompress)])
+def test_compressed_responses(client, encoding, decompress):
+    plain = client.get('/api/v1/metrics/new_case').data
+    response = client.get('/api/v1/metrics/new_case', headers={'Accept-Encoding': encoding})
+    assert response.headers['Content-Encoding'] == encoding
+    assert decompress(response.data) == plain
+    assert json.loads(plain)['total'] == len(STATES) * len(DATES)
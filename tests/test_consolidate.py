@@ -0,0 +1,82 @@
+import os
+import shutil
+
+import pandas as pd
+import pytest
+
+import processData
+import synthetic
+
+DAYS = 30
+# reported by CDC without a population, never stored
+NO_POPULATION = ['FSM', 'PW', 'RMI']
+
+
+@pytest.fixture
+def state_files(workdir):
+    """daily files of DAYS days in ./StateData, returned in date order"""
+
+    states = [s for s in processData.load_population()['State or Region Code'] if s != 'US']
+    synthetic.write_state_data('StateData', states + NO_POPULATION, DAYS)
+    return sorted(os.listdir('StateData'))
+
+
+def stored():
+    df = processData.state_store.read()
+    return df.sort_values(['Date', 'state']).reset_index(drop=True)
+
+
+def full_rebuild():
+    processData.state_store.clear()
+    os.remove(processData.manifest_file)
+    processData.consolidate_state_data()
+    return stored()
+
+
+def revise(filename):
+    df = pd.read_csv(filename)
+    df['new_case'] = df['new_case'] * 2 + 1
+    df.to_csv(filename, index=False)
+
+
+def test_new_day_matches_full_rebuild(state_files):
+    shutil.move(os.path.join('StateData', state_files[-1]), 'held.csv')
+    processData.consolidate_state_data()
+    shutil.move('held.csv', os.path.join('StateData', state_files[-1]))
+    processData.consolidate_state_data()
+    incremental = stored()
+
+    assert incremental['Date'].nunique() == DAYS
+    pd.testing.assert_frame_equal(incremental, full_rebuild())
+
+
+def test_revised_day_matches_full_rebuild(state_files):
+    processData.consolidate_state_data()
+    before = stored()
+    revise(os.path.join('StateData', state_files[DAYS // 2]))
+    processData.consolidate_state_data()
+    incremental = stored()
+
+    assert not incremental['new_case'].equals(before['new_case'])
+    pd.testing.assert_frame_equal(incremental, full_rebuild())
+
+
+def test_one_day_append_reads_only_the_tail(state_files, monkeypatch):
+    shutil.move(os.path.join('StateData', state_files[-1]), 'held.csv')
+    processData.consolidate_state_data()
+    shutil.move('held.csv', os.path.join('StateData', state_files[-1]))
+
+    reads = []
+    read = processData.state_store.read
+
+    def recording_read(start=None, end=None, **kwargs):
+        reads.append((start, end))
+        return read(start=start, end=end, **kwargs)
+
+    monkeypatch.setattr(processData.state_store, 'read', recording_read)
+    processData.consolidate_state_data()
+
+    window_start = state_files[-processData.ROLLING_WINDOW][-14:-4]
+    assert len(reads) > 0
+    for start, end in reads:
+        assert start is not None and start >= window_start
@@ -0,0 +1,57 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+import downsample
+
+
+@pytest.mark.parametrize('method', sorted(downsample.METHODS))
+@pytest.mark.parametrize('size', [1, 5, 150, 151, 997])
+@pytest.mark.parametrize('n', [4, 5, 50, 150])
+def test_indices_are_sorted_unique_and_keep_the_ends(method, size, n):
+    rng = np.random.RandomState(size * n)
+    x = np.arange(size) * 86400
+    y = rng.rand(size)
+    y[rng.rand(size) < 0.1] = np.nan
+    indices = downsample.METHODS[method](x, y, n)
+
+    assert len(indices) <= min(n, size)
+    assert (np.diff(indices) > 0).all()
+    assert indices[0] == 0 and indices[-1] == size - 1
+
+
+def test_minmax_keeps_the_extremes():
+    y = np.sin(np.linspace(0, 20, 1000))
+    indices = downsample.minmax(np.arange(1000), y, 50)
+    assert len(indices) <= 50
+    assert y.argmin() in indices and y.argmax() in indices
+
+
+def test_downsample_keeps_short_frames():
+    df = pd.DataFrame({'Date': pd.date_range('2020-01-01', periods=100), 'new_case': np.arange(100.0)})
+    assert downsample.downsample(df, 'Date', 'new_case') is df
+    long = pd.concat([df] * 5, ignore_index=True)
+    long['Date'] = pd.date_range('2020-01-01', periods=500)
+    assert len(downsample.downsample(long, 'Date', 'new_case')) <= downsample.TARGET_POINTS
+
+
+@pytest.mark.parametrize('relayout_data, expected', [
+    ({'xaxis.range[0]': '2020-03-01', 'xaxis.range[1]': '2020-04-01'}, ('2020-03-01', '2020-04-01')),
+    ({'xaxis.range': ['2020-03-01', '2020-04-01']}, ('2020-03-01', '2020-04-01')),
+    ({'xaxis.autorange': True}, None),
+    ({'autosize': True}, None),
+    (None, None),
+])
+def test_x_range(relayout_data, expected):
+    assert downsample.x_range(relayout_data) == expected
+
+
+@pytest.mark.parametrize('relayout_data, expected', [
+    ({'xaxis.range[0]': '2020-03-01', 'xaxis.range[1]': '2020-04-01'}, True),
+    ({'xaxis.range': ['2020-03-01', '2020-04-01']}, True),
+    ({'xaxis.autorange': True}, True),
+    ({'yaxis.range[0]': 0, 'yaxis.range[1]': 10}, False),
+    (None, False),
+])
+def test_changes_x(relayout_data, expected):
+    assert downsample.changes_x(relayout_data) == expected
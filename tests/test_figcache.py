@@ -0,0 +1,46 @@
+import os
+import time
+
+import figcache
+
+
+def disk_bytes(cache):
+    directory = os.path.join(cache.cache_dir, cache.version)
+    return sum(os.path.getsize(os.path.join(directory, name)) for name in os.listdir(directory))
+
+
+def test_disk_tier_is_capped(tmp_path):
+    cache = figcache.FigureCache(max_bytes=1000, cache_dir=str(tmp_path), version='v1')
+    keys = [cache.key('update_newcases_graph', ['CA', 'new_case', {'xaxis.range': [i, i + 1]}])
+            for i in range(30)]
+    for key in keys:
+        cache.put(key, 'x' * 100)
+    assert disk_bytes(cache) <= 1000
+
+    # another worker, nothing in memory, only the most recent entries are on disk
+    other = figcache.FigureCache(max_bytes=1000, cache_dir=str(tmp_path), version='v1')
+    assert other.get(keys[-1]) == 'x' * 100
+    assert other.get(keys[0]) is None
+
+
+def test_disk_reads_keep_entries(tmp_path):
+    cache = figcache.FigureCache(max_bytes=300, cache_dir=str(tmp_path), version='v1')
+    first, second, third, fourth = [cache.key('update_cases_map', [i, 'daily']) for i in range(4)]
+    for key in (first, second, third):
+        cache.put(key, 'x' * 100)
+        time.sleep(0.01)
+    other = figcache.FigureCache(max_bytes=300, cache_dir=str(tmp_path), version='v1')
+    assert other.get(first) is not None
+    time.sleep(0.01)
+    cache.put(fourth, 'x' * 100)
+
+    fresh = figcache.FigureCache(max_bytes=300, cache_dir=str(tmp_path), version='v1')
+    assert fresh.get(first) is not None
+    assert fresh.get(second) is None
+
+
+def test_figures_over_the_cap_are_not_cached(tmp_path):
+    cache = figcache.FigureCache(max_bytes=100, cache_dir=str(tmp_path), version='v1')
+    key = cache.key('update_death_figures', ['CA', None])
+    cache.put(key, 'x' * 200)
+    assert cache.get(key) is None
@@ -0,0 +1,46 @@
+import os
+
+import manifest
+
+
+def write_day(folder, date, text):
+    filename = os.path.join(folder, 'US-State-Data-{}.csv'.format(date))
+    with open(filename, 'w') as f:
+        f.write(text)
+    return filename
+
+
+def test_pending_new_changed_and_unchanged_files(tmp_path):
+    folder = str(tmp_path)
+    first = write_day(folder, '2020-11-01', 'state,new_case\nCA,1\n')
+    second = write_day(folder, '2020-11-02', 'state,new_case\nCA,2\n')
+    ingest = manifest.Manifest(str(tmp_path / 'manifest.json'))
+    assert ingest.pending('StateData', folder, set()) == ['2020-11-01', '2020-11-02']
+
+    for filename in (first, second):
+        ingest.record('StateData', manifest.file_date(filename), filename, 1)
+    ingest.save()
+    ingest = manifest.Manifest(str(tmp_path / 'manifest.json'))
+    stored = {'2020-11-01', '2020-11-02'}
+    assert ingest.pending('StateData', folder, stored) == []
+
+    # downloaded again with the same content, then revised
+    write_day(folder, '2020-11-01', 'state,new_case\nCA,1\n')
+    os.utime(first, ns=(0, 0))
+    write_day(folder, '2020-11-02', 'state,new_case\nCA,5\n')
+    assert not ingest.changed('StateData', '2020-11-01', first)
+    assert ingest.changed('StateData', '2020-11-02', second)
+    assert ingest.pending('StateData', folder, stored) == ['2020-11-02']
+
+
+def test_pending_adopts_stored_days_and_refills_lost_ones(tmp_path):
+    folder = str(tmp_path)
+    filename = write_day(folder, '2020-11-01', 'state,new_case\nCA,1\n')
+    ingest = manifest.Manifest(str(tmp_path / 'manifest.json'))
+
+    # stored before the manifest existed
+    assert ingest.pending('StateData', folder, {'2020-11-01'}) == []
+    assert ingest.entry('StateData', '2020-11-01')['sha1'] == manifest.file_hash(filename)
+
+    ingest.record('StateData', '2020-11-01', filename, 1)
+    assert ingest.pending('StateData', folder, set()) == ['2020-11-01']
@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+
+import metrics
+
+
+def state_table():
+    """date sorted rows of four states: gaps in B's days, no population for C, a zero one for D"""
+
+    rng = np.random.RandomState(0)
+    dates = pd.date_range('2020-11-01', periods=20)
+    rows = []
+    for state, population in [('A', 1000000.0), ('B', 50000.0), ('C', np.nan), ('D', 0.0)]:
+        days = dates[[0, 1, 2, 5, 6, 12, 13, 14, 19]] if state == 'B' else dates
+        for date in days:
+            rows.append({'Date': date, 'state': state, 'Population': population,
+                         'new_case': float(rng.randint(0, 200)), 'tot_cases': float(rng.randint(0, 3)),
+                         'tot_death': float(rng.randint(0, 2))})
+    df = pd.DataFrame(rows)
+    df.loc[rng.rand(len(df)) < 0.1, 'new_case'] = np.nan
+    # 0/0 case fatality and death rates, new cases over a zero population
+    df.loc[df['state'] == 'D', ['tot_cases', 'tot_death']] = 0.0
+    return df.sort_values('Date', kind='mergesort').reset_index(drop=True)
+
+
+def pandas_daily(df):
+    """the formulation metrics.STATE_DAILY_METRICS replaced"""
+
+    df = df.copy()
+    df['case fatality rate'] = (df['tot_death'].astype(float) / df['tot_cases'].astype(float)).fillna(0)
+    df['death rate'] = round((100.0 * df['tot_death'].astype(float)) / df['Population'], 8).fillna(0)
+    df['Total Cases per Population'] = df['tot_cases'] / df['Population']
+    df['New Cases per Population'] = df['new_case'] / df['Population']
+    return df
+
+
+def pandas_rolling(df):
+    """the formulation metrics.STATE_ROLLING_METRICS replaced"""
+
+    df = df.copy()
+    df['7 day average new cases'] = round(df.groupby('state')['new_case'].transform(
+        lambda x: x.rolling(7, 1).mean()), 0)
+    df['Adjusted Case Rate'] = round(100000 * df['7 day average new cases'] / df['Population'], 0)
+    col = df['Adjusted Case Rate']
+    conditions = [col < 1.0, (col >= 1.0) & (col < 4.0), (col >= 4.0) & (col < 7.0), col >= 7.0]
+    df['Risk Level'] = np.select(conditions, metrics.RISK_LEVELS)
+    return df
+
+
+def test_daily_metrics_match_pandas():
+    df = state_table()
+    with np.errstate(divide='ignore', invalid='ignore'):
+        expected = pandas_daily(df)
+    pd.testing.assert_frame_equal(metrics.evaluate(df, metrics.STATE_DAILY_METRICS), expected)
+
+
+def test_rolling_metrics_match_pandas():
+    df = state_table()
+    out = metrics.evaluate(df, metrics.STATE_ROLLING_METRICS)
+    expected = pandas_rolling(df)
+
+    for col in ['7 day average new cases', 'Adjusted Case Rate']:
+        pd.testing.assert_series_equal(out[col], expected[col])
+    assert out['Risk Level'].tolist() == expected['Risk Level'].astype(object).tolist()
+    # no population gives no rate and the '0' label, a zero one an infinite rate
+    assert set(out.loc[out['state'] == 'C', 'Risk Level']) == {'0'}
+    assert np.isinf(out.loc[out['state'] == 'D', 'Adjusted Case Rate']).any()
+
+
+def test_history_covers_the_window():
+    assert metrics.history(metrics.STATE_ROLLING_METRICS) == 6
+    assert metrics.history(metrics.STATE_DAILY_METRICS) == 0
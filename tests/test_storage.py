@@ -0,0 +1,23 @@
+import os
+
+import pandas as pd
+
+import storage
+
+
+def test_migrate_csv_unsorted_in_chunks(tmp_path):
+    df = pd.DataFrame({'Date': ['2020-11-02', '2020-11-01', '2020-11-03', '2020-11-01', '2020-11-02'],
+                       'cdc_report_dt': ['a', 'b', 'c', 'd', 'e'],
+                       'sex': ['Male', 'Female', None, 'Male', 'Female']})
+    csv_file = str(tmp_path / 'CaseSurvData.csv')
+    df.to_csv(csv_file, index=False)
+    store = storage.PartitionedStore(str(tmp_path / 'store'), storage.CASE_SURV_SCHEMA)
+
+    assert store.migrate_csv(csv_file, chunksize=2)
+    assert store.dates() == ['2020-11-01', '2020-11-02', '2020-11-03']
+    assert not os.path.exists(str(tmp_path / 'store' / '.migrate'))
+    out = store.read()
+    assert sorted(out['cdc_report_dt']) == sorted(df['cdc_report_dt'])
+    day = store.read(start='2020-11-02', end='2020-11-02')
+    assert list(day['cdc_report_dt']) == ['a', 'e']
+    assert not store.migrate_csv(csv_file)